@@ -0,0 +1,212 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from cache import row_to_request
+
+ARCHIVE_PREFIX = 'Requests_'
+REQUESTS_HEADER = ['Request ID', 'User ID', 'Name', 'Department', 'Floor', 'Topic', 'Description', 'Date',
+                   'Status', 'Accepted By', 'Accepted At', 'Solved At']
+
+
+def request_month(request_id):
+    # Request IDs start with their creation time: %Y%m%d%H%M%S_userid
+    try:
+        return datetime.strptime(str(request_id)[:14], "%Y%m%d%H%M%S").strftime("%Y_%m")
+    except ValueError:
+        return None
+
+
+def archive_sheet_name(month):
+    return f"{ARCHIVE_PREFIX}{month}"
+
+
+def row_date(row):
+    try:
+        return datetime.strptime(row[7], "%Y-%m-%d %H:%M:%S")
+    except (IndexError, ValueError):
+        return None
+
+
+def _cells(values):
+    return {'values': [{'userEnteredValue': {'stringValue': str(value)}} for value in values]}
+
+
+def _contiguous(row_numbers):
+    # [(first, last), ...] from the highest rows down, so deleting one range
+    # does not shift the ones still to be deleted
+    ranges = []
+    for row_number in sorted(row_numbers, reverse=True):
+        if ranges and ranges[-1][0] == row_number + 1:
+            ranges[-1] = (row_number, ranges[-1][1])
+        else:
+            ranges.append((row_number, row_number))
+    return ranges
+
+
+# Moves solved requests older than `after_days` from the Requests sheet into
+# per-month Requests_YYYY_MM sheets. Each run moves up to `batch_size` rows with
+# a single spreadsheets.batchUpdate (create sheets, append rows, delete rows),
+# which Sheets applies atomically, after checking that the rows to delete still
+# hold the cached request IDs.
+class Archiver:
+    def __init__(self, database, spreadsheet_id, after_days, interval, batch_size):
+        self.db = database
+        self.spreadsheet_id = spreadsheet_id
+        self.after_days = after_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self._sheet_ids = None
+        self._cache = {}
+        self._task = None
+        self.archived = 0
+
+    async def _load_sheet_ids(self):
+        result = await self.db._execute(self.db.service.spreadsheets().get(
+            spreadsheetId=self.spreadsheet_id,
+            fields='sheets.properties(sheetId,title)'
+        ))
+        self._sheet_ids = {
+            sheet['properties']['title']: sheet['properties']['sheetId']
+            for sheet in result.get('sheets', [])
+        }
+
+    async def sheet_ids(self):
+        if self._sheet_ids is None:
+            await self._load_sheet_ids()
+        return self._sheet_ids
+
+    def candidates(self):
+        cutoff = datetime.now() - timedelta(days=self.after_days)
+        busy = {op['request_id'] for op in self.db.writes.pending() if op['kind'] == 'status'}
+        rows = []
+        for row_number, row in sorted(self.db.requests.by_row().items()):
+            request = row_to_request(row)
+            created = row_date(row)
+            if (request['status'] == "Solved" and created is not None and created < cutoff
+                    and request['request_id'] not in busy):
+                rows.append((row_number, row))
+                if len(rows) >= self.batch_size:
+                    break
+        return rows
+
+    async def _rows_moved(self, rows):
+        # Row numbers come from the cache; rows deleted or sorted by hand since
+        # then would make deleteDimension remove other requests. Sheets has no
+        # conditional delete, so the IDs are checked right before the batchUpdate.
+        blocks = _contiguous(row_number for row_number, _ in rows)
+        result = await self.db._execute(self.db.service.spreadsheets().values().batchGet(
+            spreadsheetId=self.spreadsheet_id,
+            ranges=[f"Requests!A{first}:A{last}" for first, last in blocks]
+        ))
+        sheet_ids = {}
+        for (first, _), value_range in zip(blocks, result.get('valueRanges', [])):
+            for offset, cells in enumerate(value_range.get('values', [])):
+                sheet_ids[first + offset] = str(cells[0]).strip() if cells else ""
+        return any(sheet_ids.get(row_number) != str(row[0]).strip() for row_number, row in rows)
+
+    def _reload(self, rows):
+        self.db.requests.load(rows)
+        self.db._reapply_pending_statuses()
+
+    async def archive(self):
+        index = self.db.requests
+        async with self.db.writes.paused(), index.locked():
+            rows = self.candidates()
+            if not rows:
+                return 0
+            if await self._rows_moved(rows):
+                logging.warning("Requests sheet rows moved since they were cached, reloading before archiving")
+                self._reload(await self.db._load_requests())
+                return 0
+            sheet_ids = await self.sheet_ids()
+            requests = []
+            by_month = {}
+            for row_number, row in rows:
+                month = request_month(row[0]) or row_date(row).strftime("%Y_%m")
+                by_month.setdefault(month, []).append(row)
+
+            next_id = max(sheet_ids.values(), default=0) + 1
+            new_sheets = {}
+            for month, month_rows in sorted(by_month.items()):
+                title = archive_sheet_name(month)
+                sheet_id = sheet_ids.get(title)
+                if sheet_id is None:
+                    sheet_id = new_sheets[title] = next_id
+                    next_id += 1
+                    requests.append({'addSheet': {'properties': {'sheetId': sheet_id, 'title': title}}})
+                    month_rows = [REQUESTS_HEADER] + month_rows
+                requests.append({'appendCells': {
+                    'sheetId': sheet_id,
+                    'rows': [_cells(row) for row in month_rows],
+                    'fields': 'userEnteredValue'
+                }})
+            for first, last in _contiguous(row_number for row_number, _ in rows):
+                requests.append({'deleteDimension': {'range': {
+                    'sheetId': sheet_ids['Requests'], 'dimension': 'ROWS',
+                    'startIndex': first - 1, 'endIndex': last
+                }}})
+
+            try:
+                await self.db._execute(self.db.service.spreadsheets().batchUpdate(
+                    spreadsheetId=self.spreadsheet_id,
+                    body={'requests': requests}
+                ), write=True)
+            except Exception as error:
+                # Another process may have added sheets meanwhile
+                self._sheet_ids = None
+                if isinstance(error, OSError):
+                    # The move may or may not have been applied, read the sheet again
+                    self._reload(await self.db._load_requests())
+                raise
+            sheet_ids.update(new_sheets)
+            index.remove_rows({row_number for row_number, _ in rows})
+            for month in by_month:
+                self._cache.pop(archive_sheet_name(month), None)
+        self.archived += len(rows)
+        logging.info(f"Archived {len(rows)} solved requests into {len(by_month)} sheets")
+        return len(rows)
+
+    async def find(self, request_id):
+        # Looks up an archived request in the sheet named after its ID's month
+        month = request_month(request_id)
+        if month is None:
+            return None
+        title = archive_sheet_name(month)
+        if title not in await self.sheet_ids():
+            return None
+        rows = self._cache.get(title)
+        if rows is None:
+            result = await self.db._execute(self.db.service.spreadsheets().values().get(
+                spreadsheetId=self.spreadsheet_id,
+                range=f"{title}!A:L"
+            ))
+            rows = {str(row[0]).strip(): row for row in result.get('values', [])[1:] if row}
+            # Keep only the most recently read month
+            self._cache = {title: rows}
+        return rows.get(str(request_id).strip())
+
+    async def _run(self):
+        while True:
+            try:
+                # Keep going while there are full batches left
+                while await self.archive() >= self.batch_size:
+                    await asyncio.sleep(1)
+            except Exception as e:
+                logging.error(f"Archiving solved requests failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {'archived': self.archived}
@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from aiohttp import web
+from fakes import FakeSheetsService, FakeTelegramSession, FakeUpdatePoster, install_fake_sheets
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Replay synthetic updates through the bot handlers against local fake Sheets and Telegram APIs")
+    parser.add_argument('--users', type=int, default=500, help="registered users in the Users sheet")
+    parser.add_argument('--seed-requests', type=int, default=5000, help="existing rows in the Requests sheet")
+    parser.add_argument('--requests', type=int, default=200, help="new requests to create")
+    parser.add_argument('--rate', type=float, default=600, help="new requests per minute")
+    parser.add_argument('--registrations', type=int, default=20, help="new users registering during the run")
+    parser.add_argument('--accept-clicks', type=int, default=1,
+                        help="staff clicking accept/solve on every request at the same time")
+    parser.add_argument('--sheets-latency', type=float, default=0.15, help="seconds per Sheets call")
+    parser.add_argument('--telegram-latency', type=float, default=0.05, help="seconds per Bot API call")
+    parser.add_argument('--sheets-quota', type=int, default=100000, help="Sheets requests per minute")
+    parser.add_argument('--backend', choices=['sheets', 'sqlite'], default='sheets')
+    parser.add_argument('--duplicate-rate', type=float, default=0.0,
+                        help="share of new requests repeating the same complaint")
+    parser.add_argument('--webhook', action='store_true',
+                        help="post updates over HTTP to the webhook server instead of feeding the dispatcher")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args()
+
+
+def configure_environment(args, workdir):
+    os.environ.setdefault('BOT_TOKEN', '123456:BENCHMARK')
+    os.environ.setdefault('GROUP_CHAT_ID', '-1001')
+    os.environ.setdefault('SPREADSHEET_ID', 'benchmark')
+    os.environ.update({
+        'STORAGE_BACKEND': args.backend,
+        'SQLITE_PATH': os.path.join(workdir, 'bot.db'),
+        'SQLITE_MIRROR_TO_SHEETS': 'false',
+        'SQLITE_IMPORT_FROM_SHEETS': 'true',
+        'FSM_STORAGE': 'memory',
+        'METRICS_PORT': '0',
+        'WEBHOOK_SECRET': 'benchmark',
+        'WRITE_SPOOL_FILE': os.path.join(workdir, 'pending_writes.jsonl'),
+        'SHEETS_READS_PER_MINUTE': str(args.sheets_quota),
+        'SHEETS_WRITES_PER_MINUTE': str(args.sheets_quota),
+        'SHEETS_BURST': str(max(args.sheets_quota // 60, 1)),
+        'TELEGRAM_MESSAGES_PER_SECOND': '1000',
+        'TELEGRAM_GROUP_MESSAGES_PER_MINUTE': '60000',
+        'TELEGRAM_CHAT_MESSAGES_PER_SECOND': '1000'
+    })
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Benchmark:
+    def __init__(self, args, app, sheets, session):
+        self.args = args
+        self.app = app
+        self.sheets = sheets
+        self.session = session
+        self.latencies = defaultdict(list)
+        self.updates = 0
+        self.staff_tasks = []
+        self.poster = None
+        self._update_id = 0
+
+    def _next_id(self):
+        self._update_id += 1
+        return self._update_id
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}", 'username': f"user{user_id}"}
+
+    def message(self, user_id, text=None, contact=None):
+        update_id = self._next_id()
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id)
+        }
+        if text is not None:
+            message['text'] = text
+        if contact is not None:
+            message['contact'] = contact
+        return {'update_id': update_id, 'message': message}
+
+    def callback(self, user_id, data, chat_id, message_id):
+        update_id = self._next_id()
+        return {'update_id': update_id, 'callback_query': {
+            'id': str(update_id),
+            'chat_instance': 'benchmark',
+            'from': self._user(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'},
+                'text': "benchmark"
+            }
+        }}
+
+    async def feed(self, step, update):
+        started = time.perf_counter()
+        if self.poster is not None:
+            await self.poster.post(update)
+        else:
+            update = self.app.types.Update.model_validate(update, context={'bot': self.app.bot})
+            await self.app.dp.feed_update(self.app.bot, update)
+        self.latencies[step].append(time.perf_counter() - started)
+        self.updates += 1
+
+    async def start_webhook(self):
+        # The webhook server on a free local port, warmed up by its startup hook
+        runner = web.AppRunner(self.app.create_webhook_app())
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 0).start()
+        host, port = runner.addresses[0][:2]
+        self.poster = FakeUpdatePoster(
+            self.app.dp, f"http://{host}:{port}{self.app.WEBHOOK_PATH}", self.app.WEBHOOK_SECRET)
+        return runner
+
+    async def stop_webhook(self, runner):
+        # Updates posted right before shutdown must still be handled before the
+        # server closes and pending writes are flushed. The server replies before
+        # handling them, so they are all still in progress here.
+        handled = self.poster.handled
+        last = [self.message(1000 + i, "/start") for i in range(20)]
+        await asyncio.gather(*[self.poster.post(update, wait=False) for update in last])
+        await runner.cleanup()
+        await self.poster.close()
+        drained = self.poster.handled - handled
+        print(f"drained on shutdown: {drained}/{len(last)} updates, "
+              f"{self.app.db.stats().get('pending_writes', 0)} writes left")
+
+    async def request_flow(self, user_id, description):
+        await self.feed('cmd_start', self.message(user_id, "/start"))
+        await self.feed('handle_create_request', self.message(user_id, "So'rov yaratish"))
+        await self.feed('handle_topic_selection', self.callback(user_id, "topic_Internet", user_id, 1))
+        await self.feed('handle_description', self.message(user_id, description))
+
+    async def registration_flow(self, user_id):
+        await self.feed('cmd_start', self.message(user_id, "/start"))
+        await self.feed('handle_contact', self.message(
+            user_id, contact={'phone_number': f"+998{user_id}", 'first_name': "New", 'user_id': user_id}))
+        await self.feed('handle_name', self.message(user_id, f"New User {user_id}"))
+        await self.feed('handle_department', self.message(user_id, "Buxgalteriya"))
+        await self.feed('handle_floor_selection', self.callback(user_id, "floor_2", user_id, 1))
+
+    async def staff_flow(self, message_id, accept_data):
+        from keyboards import RequestCallback
+        group_id = int(self.app.GROUP_CHAT_ID)
+        staff = [1 + i for i in range(self.args.accept_clicks)]
+        await asyncio.gather(*[
+            self.feed('handle_accept_button', self.callback(staff_id, accept_data, group_id, message_id))
+            for staff_id in staff
+        ])
+        solve_data = RequestCallback.unpack(accept_data).model_copy(update={'action': 'solve'}).pack()
+        await asyncio.gather(*[
+            self.feed('handle_solve_button', self.callback(staff_id, solve_data, group_id, message_id))
+            for staff_id in staff
+        ])
+
+    def on_telegram_request(self, method, result):
+        # Staff react to every request posted to the group
+        markup = getattr(method, 'reply_markup', None)
+        if str(getattr(method, 'chat_id', '')) != str(self.app.GROUP_CHAT_ID) or markup is None:
+            return
+        if type(method).__name__ != 'SendMessage':
+            return
+        accept_data = markup.inline_keyboard[0][1].callback_data
+        self.staff_tasks.append(asyncio.create_task(self.staff_flow(result.message_id, accept_data)))
+
+    async def run(self):
+        args = self.args
+        self.session.on_request = self.on_telegram_request
+        # With --backend sqlite this also imports the seeded sheets into the empty database
+        if args.webhook:
+            runner = await self.start_webhook()
+        else:
+            await self.app.db.warm_up()
+
+        flows = ['request'] * args.requests + ['registration'] * args.registrations
+        random.shuffle(flows)
+        interval = 60 / args.rate if args.rate else 0
+        started = time.perf_counter()
+        tasks = []
+        # Distinct users while there are enough, one user's flows would share FSM state
+        request_users = random.sample(range(args.users), min(args.requests, args.users))
+        requests_started = 0
+        for number, flow in enumerate(flows):
+            if flow == 'request':
+                user_id = 1000 + request_users[requests_started % len(request_users)]
+                requests_started += 1
+                if random.random() < args.duplicate_rate:
+                    description = "Internet ishlamayapti"
+                else:
+                    description = f"Internet ishlamayapti, xona {number}"
+                tasks.append(asyncio.create_task(self.request_flow(user_id, description)))
+            else:
+                tasks.append(asyncio.create_task(self.registration_flow(5_000_000 + number)))
+            await asyncio.sleep(interval)
+        await asyncio.gather(*tasks)
+        while self.app.outbox.stats()['queued'] or any(not task.done() for task in self.staff_tasks):
+            await asyncio.gather(*self.staff_tasks)
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        if args.webhook:
+            await self.stop_webhook(runner)
+        else:
+            await self.app.shutdown_services()
+        return elapsed
+
+    def report(self, elapsed):
+        print(f"{'handler':<26}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for step, values in sorted(self.latencies.items()):
+            print(f"{step:<26}{len(values):>8}"
+                  f"{percentile(values, 0.50) * 1000:>10.1f}{percentile(values, 0.95) * 1000:>10.1f}"
+                  f"{percentile(values, 0.99) * 1000:>10.1f}{max(values) * 1000:>10.1f}")
+        print()
+        print(f"updates:            {self.updates}")
+        print(f"elapsed:            {elapsed:.2f}s")
+        print(f"throughput:         {self.updates / elapsed:.1f} updates/s")
+        calls = self.sheets.total_calls()
+        print(f"sheets calls:       {calls} ({calls / max(self.updates, 1):.3f} per update) "
+              f"{dict(sorted(self.sheets.calls.items()))}")
+        print(f"telegram calls:     {sum(self.session.calls.values())} {dict(sorted(self.session.calls.items()))}")
+        linked = {scope: count for (scope,), count in self.app.duplicate_requests.values.items()}
+        print(f"duplicates linked:  {sum(linked.values())} {linked}")
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix='it-bot-benchmark-')
+    configure_environment(args, workdir)
+
+    sheets = FakeSheetsService(latency=args.sheets_latency)
+    sheets.seed_users(args.users)
+    sheets.seed_requests(args.seed_requests, users=args.users)
+    install_fake_sheets(sheets)
+
+    import bot as app
+    session = FakeTelegramSession(latency=args.telegram_latency)
+    app.bot.session = session
+    logging.getLogger().setLevel(args.log_level)
+
+    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} backend={args.backend} users={args.users} "
+          f"rows={args.seed_requests} requests={args.requests} rate={args.rate}/min "
+          f"accept_clicks={args.accept_clicks} sheets_latency={args.sheets_latency}s"
+          f"{' webhook' if args.webhook else ''}")
+    benchmark = Benchmark(args, app, sheets, session)
+    elapsed = asyncio.run(benchmark.run())
+    benchmark.report(elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,84 @@
 import logging
+import time
 from datetime import datetime
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject, ChatMemberUpdatedFilter, KICKED, MEMBER
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN, GROUP_CHAT_ID
+from config import (BOT_TOKEN, GROUP_CHAT_ID, TELEGRAM_MESSAGES_PER_SECOND, TELEGRAM_GROUP_MESSAGES_PER_MINUTE,
+                    TELEGRAM_CHAT_MESSAGES_PER_SECOND, RUN_MODE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+                    WEBAPP_HOST, WEBAPP_PORT, LOG_LEVEL, METRICS_HOST, METRICS_PORT, ADMIN_IDS,
+                    BROADCAST_MESSAGES_PER_SECOND, BROADCAST_WORKERS, BROADCAST_STATE_FILE, DUPLICATE_WINDOW,
+                    DUPLICATE_CACHE_SIZE, OUTBOX_SPOOL_FILE)
 from database import db
-from keyboards import create_topic_keyboard, create_request_keyboard, create_solved_keyboard, create_floor_keyboard
+from storage import UNAVAILABLE
+from outbox import Outbox
+from broadcast import Broadcaster, parse_audience
+from dedup import DuplicateCache
+import events
+from locks import KeyedLocks
+from fsm_storage import create_fsm_storage
+from webhook import create_app
+from metrics import registry, HandlerTimingMiddleware, start_metrics_server, duplicate_requests
+from dashboard import format_stats, format_queue
+from keyboards import (create_topic_keyboard, create_request_keyboard, create_solved_keyboard, create_floor_keyboard,
+                       RequestCallback, legacy_request_id)
+
+# Time to ready is measured from here; building the Sheets client on import is logged by database.py
+started_at = time.perf_counter()
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=LOG_LEVEL)
 
 # Initialize bot and dispatcher
 bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+storage = create_fsm_storage()
 dp = Dispatcher(storage=storage)
+outbox = Outbox(bot, TELEGRAM_MESSAGES_PER_SECOND, TELEGRAM_GROUP_MESSAGES_PER_MINUTE, TELEGRAM_CHAT_MESSAGES_PER_SECOND,
+                OUTBOX_SPOOL_FILE)
+request_locks = KeyedLocks()
+broadcaster = Broadcaster(bot, outbox, BROADCAST_STATE_FILE, BROADCAST_MESSAGES_PER_SECOND, BROADCAST_WORKERS)
+duplicates = DuplicateCache(DUPLICATE_WINDOW, DUPLICATE_CACHE_SIZE)
+
+# Shard workers share duplicate detection, see shards.py
+events.on('duplicate', lambda event: duplicates.add(
+    event['request_id'], event['user_id'], event['floor'], event['topic'], event['description']))
+events.on('watch', lambda event: duplicates.watch(event['request_id'], event['user_id']))
+events.on('forget', lambda event: duplicates.forget(event['request_id']))
+
+# Users who blocked the bot get broadcasts again once they write to it
+async def unblock_sender(handler, event, data):
+    user = data.get('event_from_user')
+    if user is not None:
+        broadcaster.unblock(user.id)
+    return await handler(event, data)
+
+dp.update.outer_middleware(unblock_sender)
+
+# Unblocking the bot is also reported by Telegram. In sharded mode broadcasts
+# may run in another worker, which is told through an event.
+@dp.my_chat_member(ChatMemberUpdatedFilter(member_status_changed=KICKED >> MEMBER))
+async def handle_bot_unblocked(event: types.ChatMemberUpdated):
+    broadcaster.unblock(event.from_user.id)
+    events.publish('unblock', user_id=event.from_user.id)
+
+events.on('unblock', lambda event: broadcaster.unblock(event['user_id']))
+
+# Metrics
+dp.message.middleware(HandlerTimingMiddleware())
+dp.callback_query.middleware(HandlerTimingMiddleware())
+
+def queue_depths():
+    depths = {'outbox': outbox.stats()['queued'], 'broadcast': broadcaster.stats()['queued']}
+    storage_stats = db.stats()
+    if 'pending_writes' in storage_stats:
+        depths['sheets_writes'] = storage_stats['pending_writes']
+        depths['sheets_read_limiter'] = storage_stats['read_limiter']['queue_depth']
+        depths['sheets_write_limiter'] = storage_stats['write_limiter']['queue_depth']
+    return depths
+
+registry.gauge('bot_queue_depth', "Items waiting in internal queues", 'queue', queue_depths)
 
 # Create main keyboard
 main_keyboard = types.ReplyKeyboardMarkup(
@@ -25,6 +88,8 @@ main_keyboard = types.ReplyKeyboardMarkup(
     resize_keyboard=True
 )
 
+USERS_UNAVAILABLE_TEXT = "Ma'lumotlarni hozir olib bo'lmadi. Iltimos, keyinroq qayta urinib ko'ring."
+
 # States
 class RegistrationStates(StatesGroup):
     waiting_for_phone = State()
@@ -42,7 +107,10 @@ class RequestStates(StatesGroup):
 async def cmd_start(message: types.Message):
     user_data = await db.get_user_data(message.from_user.id)
     
-    if user_data:
+    if user_data is UNAVAILABLE:
+        # Registered users must not be sent through registration again
+        await message.answer(USERS_UNAVAILABLE_TEXT)
+    elif user_data:
         await message.answer(
             f"Xush kelibsiz, {user_data['name']}! 'So'rov yaratish' tugmasini bosib yangi so'rov yaratishingiz mumkin.",
             reply_markup=main_keyboard
@@ -57,6 +125,60 @@ async def cmd_start(message: types.Message):
         )
         await message.answer("Iltimos, telefon raqamingizni ulashish uchun quyidagi tugmani bosing.")
 
+def is_staff_chat(message: types.Message):
+    return str(message.chat.id) == str(GROUP_CHAT_ID)
+
+# Staff dashboard, answered from counters kept in memory by the storage
+@dp.message(Command("stats"), is_staff_chat)
+async def cmd_stats(message: types.Message):
+    snapshot = await db.request_stats()
+    if snapshot is None:
+        await message.answer("Statistikani olish muvaffaqiyatsiz tugadi. Iltimos, keyinroq qayta urinib ko'ring.")
+        return
+    await message.answer(format_stats(snapshot))
+
+@dp.message(Command("queue"), is_staff_chat)
+async def cmd_queue(message: types.Message):
+    snapshot = await db.request_stats()
+    if snapshot is None:
+        await message.answer("Navbatni olish muvaffaqiyatsiz tugadi. Iltimos, keyinroq qayta urinib ko'ring.")
+        return
+    await message.answer(format_queue(snapshot))
+
+# /broadcast [floor=N] [department=Name] text
+@dp.message(Command("broadcast"), is_staff_chat)
+async def cmd_broadcast(message: types.Message, command: CommandObject):
+    if ADMIN_IDS and message.from_user.id not in ADMIN_IDS:
+        await message.answer("Sizda xabarnoma yuborish huquqi yo'q.")
+        return
+    filters, text = parse_audience(command.args)
+    if not text:
+        await message.answer("Foydalanish: /broadcast [floor=3] [department=Bo'lim] xabar matni")
+        return
+
+    users = await db.get_users(**filters)
+    if users is None:
+        await message.answer("Foydalanuvchilar ro'yxatini olish muvaffaqiyatsiz tugadi.")
+        return
+    if not users:
+        await message.answer("Bu shartlarga mos foydalanuvchilar topilmadi.")
+        return
+
+    progress = await message.answer(f"Xabarnoma {len(users)} foydalanuvchiga yuborilmoqda...")
+    job = broadcaster.start(text, [user['telegram_id'] for user in users], progress.chat.id, progress.message_id)
+    logging.info(f"Broadcast {job['id']} started by {message.from_user.id} for {len(job['recipients'])} users")
+
+@dp.message(Command("broadcast_cancel"), is_staff_chat)
+async def cmd_broadcast_cancel(message: types.Message, command: CommandObject):
+    if ADMIN_IDS and message.from_user.id not in ADMIN_IDS:
+        await message.answer("Sizda xabarnoma yuborish huquqi yo'q.")
+        return
+    cancelled = broadcaster.cancel(command.args.strip() if command.args else None)
+    if cancelled:
+        await message.answer(f"To'xtatildi: {', '.join(cancelled)}")
+    else:
+        await message.answer("Yuborilayotgan xabarnoma yo'q.")
+
 @dp.message(F.contact)
 async def handle_contact(message: types.Message, state: FSMContext):
     await state.update_data(phone=message.contact.phone_number)
@@ -96,6 +218,9 @@ async def handle_floor_selection(callback: types.CallbackQuery, state: FSMContex
 @dp.message(F.text == "So'rov yaratish")
 async def handle_create_request(message: types.Message, state: FSMContext):
     user_data = await db.get_user_data(message.from_user.id)
+    if user_data is UNAVAILABLE:
+        await message.answer(USERS_UNAVAILABLE_TEXT)
+        return
     if not user_data:
         await message.answer("Iltimos, avval /start buyrug'i orqali ro'yxatdan o'ting.")
         return
@@ -113,8 +238,29 @@ async def handle_topic_selection(callback: types.CallbackQuery, state: FSMContex
 @dp.message(RequestStates.waiting_for_description)
 async def handle_description(message: types.Message, state: FSMContext):
     user_data = await db.get_user_data(message.from_user.id)
+    if user_data is UNAVAILABLE:
+        # The state is kept, the description can be sent again
+        await message.answer(USERS_UNAVAILABLE_TEXT)
+        return
     request_data = await state.get_data()
-    
+
+    # The same problem reported again recently: link to the open request
+    existing_id, scope = duplicates.find(message.from_user.id, user_data['floor'], request_data['topic'], message.text)
+    if existing_id:
+        existing = await db.get_request_data(existing_id)
+        if existing and existing['status'] != "Solved":
+            if str(existing['user_id']) != str(message.from_user.id):
+                duplicates.watch(existing_id, message.from_user.id)
+                events.publish('watch', request_id=existing_id, user_id=message.from_user.id)
+            duplicate_requests.inc(scope)
+            logging.info(f"Request from {message.from_user.id} linked to open duplicate '{existing_id}'")
+            await state.clear()
+            await message.answer(
+                f"Bu muammo bo'yicha so'rov allaqachon yuborilgan (So'rov ID: {existing_id}). "
+                f"Uning holati haqida sizga xabar beramiz."
+            )
+            return
+
     # Generate a unique request ID (timestamp + user_id)
     request_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{message.from_user.id}"
     logging.info(f"Creating new request with ID: '{request_id}'")
@@ -141,8 +287,11 @@ async def handle_description(message: types.Message, state: FSMContext):
     })
 
     if await db.save_request(request_data):
+        duplicates.add(request_id, message.from_user.id, user_data['floor'], request_data['topic'], message.text)
+        events.publish('duplicate', request_id=request_id, user_id=message.from_user.id, floor=user_data['floor'],
+                       topic=request_data['topic'], description=message.text)
         # Send to group with inline keyboard
-        await bot.send_message(
+        await outbox.send_message(
             chat_id=GROUP_CHAT_ID,
             text=request_text,
             reply_markup=create_request_keyboard(request_id)
@@ -152,11 +301,10 @@ async def handle_description(message: types.Message, state: FSMContext):
     else:
         await message.answer("So'rov yuborish muvaffaqiyatsiz tugadi. Iltimos, keyinroq qayta urinib ko'ring.")
 
+@dp.callback_query(RequestCallback.filter(F.action == "reply"))
 @dp.callback_query(F.data.startswith("reply_"))
-async def handle_reply_button(callback: types.CallbackQuery, state: FSMContext):
-    # Get the full request ID from the message text
-    message_text = callback.message.text
-    request_id = message_text.split("So'rov ID: ")[-1].strip()
+async def handle_reply_button(callback: types.CallbackQuery, state: FSMContext, callback_data: RequestCallback = None):
+    request_id = callback_data.request_id if callback_data else legacy_request_id(callback.data)
     logging.info(f"Reply button clicked for request: '{request_id}'")
     await state.update_data(request_id=request_id)
     await callback.message.answer("Iltimos, javobingizni kiriting:")
@@ -174,7 +322,7 @@ async def handle_reply_text(message: types.Message, state: FSMContext):
         if result:
             user_id = result['user_id']
             # Send reply to the user
-            await bot.send_message(
+            await outbox.send_message(
                 chat_id=int(user_id),
                 text=f"So'rovingizga javob:\n{message.text}"
             )
@@ -189,85 +337,174 @@ async def handle_reply_text(message: types.Message, state: FSMContext):
     
     await state.clear()
 
+@dp.callback_query(RequestCallback.filter(F.action == "accept"))
 @dp.callback_query(F.data.startswith("accept_"))
-async def handle_accept_button(callback: types.CallbackQuery):
-    # Get the full request ID from the message text
-    message_text = callback.message.text
-    request_id = message_text.split("So'rov ID: ")[-1].strip()
+async def handle_accept_button(callback: types.CallbackQuery, callback_data: RequestCallback = None):
+    request_id = callback_data.request_id if callback_data else legacy_request_id(callback.data)
     logging.info(f"Accept button clicked for request: '{request_id}'")
     
     try:
-        # Get request data to check if it's already accepted
-        request_data = await db.get_request_data(request_id)
-        if not request_data:
-            logging.error(f"Request not found for acceptance: '{request_id}'")
-            await callback.answer("So'rov topilmadi!")
-            return
-            
-        if request_data['status'] == "Accepted":
-            await callback.answer("Bu so'rov allaqachon qabul qilingan!")
-            return
-            
-        if await db.update_request_status(request_id, "Accepted", callback.from_user.username):
+        # Clicks on the same request are handled one at a time
+        async with request_locks.lock(request_id):
+            # Get request data to check if it's already accepted
+            request_data = await db.get_request_data(request_id)
+            if not request_data:
+                logging.error(f"Request not found for acceptance: '{request_id}'")
+                await callback.answer("So'rov topilmadi!")
+                return
+
+            if request_data['status'] != "Pending":
+                await callback.answer("Bu so'rov allaqachon qabul qilingan!")
+                return
+
+            accepted = await db.update_request_status(
+                request_id, "Accepted", callback.from_user.username, expected_status="Pending")
+
+        if accepted:
             # Update message with new keyboard
-            await callback.message.edit_reply_markup(
+            await outbox.edit_reply_markup(
+                chat_id=callback.message.chat.id,
+                message_id=callback.message.message_id,
                 reply_markup=create_solved_keyboard(request_id)
             )
             await callback.answer("So'rov qabul qilindi!")
             
             # Send notification to the user
-            await bot.send_message(
+            await outbox.send_message(
                 chat_id=int(request_data['user_id']),
                 text=f"So'rovingiz qabul qilindi va tez orada hal qilinadi!"
             )
+            # Users whose reports were linked to this request
+            for user_id in duplicates.watchers(request_id):
+                await outbox.send_message(chat_id=user_id, text=f"So'rovingiz qabul qilindi va tez orada hal qilinadi!")
+        elif (await db.get_request_data(request_id) or request_data)['status'] != "Pending":
+            # Accepted through another bot process in the meantime
+            await callback.answer("Bu so'rov allaqachon qabul qilingan!")
         else:
             await callback.answer("So'rovni qabul qilish muvaffaqiyatsiz tugadi")
     except Exception as e:
         logging.error(f"Error accepting request: {e}")
         await callback.answer("So'rovni qabul qilish muvaffaqiyatsiz tugadi")
 
+@dp.callback_query(RequestCallback.filter(F.action == "solve"))
 @dp.callback_query(F.data.startswith("solve_"))
-async def handle_solve_button(callback: types.CallbackQuery):
-    # Get the full request ID from the message text
-    message_text = callback.message.text
-    request_id = message_text.split("So'rov ID: ")[-1].strip()
+async def handle_solve_button(callback: types.CallbackQuery, callback_data: RequestCallback = None):
+    request_id = callback_data.request_id if callback_data else legacy_request_id(callback.data)
     logging.info(f"Solve button clicked for request: '{request_id}'")
     
     try:
-        # Get request data to check if it's already solved
-        request_data = await db.get_request_data(request_id)
-        if not request_data:
-            logging.error(f"Request not found for solving: '{request_id}'")
-            await callback.answer("So'rov topilmadi!")
-            return
-            
-        if request_data['status'] == "Solved":
-            await callback.answer("Bu so'rov allaqachon hal qilingan!")
-            return
-            
-        if request_data['accepted_by'] != callback.from_user.username:
-            await callback.answer("Faqat so'rovni qabul qilgan shaxs uni hal qilgani sifatida belgilashi mumkin!")
-            return
-            
-        if await db.update_request_status(request_id, "Solved"):
+        async with request_locks.lock(request_id):
+            # Get request data to check if it's already solved
+            request_data = await db.get_request_data(request_id)
+            if not request_data:
+                logging.error(f"Request not found for solving: '{request_id}'")
+                await callback.answer("So'rov topilmadi!")
+                return
+
+            if request_data['status'] == "Solved":
+                await callback.answer("Bu so'rov allaqachon hal qilingan!")
+                return
+
+            if request_data['accepted_by'] != callback.from_user.username:
+                await callback.answer("Faqat so'rovni qabul qilgan shaxs uni hal qilgani sifatida belgilashi mumkin!")
+                return
+
+            solved = await db.update_request_status(request_id, "Solved", expected_status="Accepted")
+
+        if solved:
             # Remove keyboard
-            await callback.message.edit_reply_markup(reply_markup=None)
+            await outbox.edit_reply_markup(
+                chat_id=callback.message.chat.id,
+                message_id=callback.message.message_id,
+                reply_markup=None
+            )
             await callback.answer("So'rov hal qilingan sifatida belgilandi!")
             
             # Send notification to the user
-            await bot.send_message(
+            await outbox.send_message(
                 chat_id=int(request_data['user_id']),
                 text=f"So'rovingiz hal qilindi!"
             )
+            for user_id in duplicates.watchers(request_id):
+                await outbox.send_message(chat_id=user_id, text=f"So'rovingiz hal qilindi!")
+            duplicates.forget(request_id)
+            events.publish('forget', request_id=request_id)
+        elif (await db.get_request_data(request_id) or request_data)['status'] == "Solved":
+            await callback.answer("Bu so'rov allaqachon hal qilingan!")
         else:
             await callback.answer("So'rovni hal qilingan sifatida belgilash muvaffaqiyatsiz tugadi")
     except Exception as e:
         logging.error(f"Error solving request: {e}")
         await callback.answer("So'rovni hal qilingan sifatida belgilash muvaffaqiyatsiz tugadi")
 
+async def shutdown_services():
+    # Unfinished broadcasts are saved and resumed on the next start
+    await broadcaster.close()
+    await outbox.close()
+    # Flush writes that are still waiting in the batch window
+    await db.close()
+
+def health_status():
+    return {'storage': db.stats(), 'outbox': outbox.stats(), 'broadcast': broadcaster.stats(),
+            'duplicates': duplicates.stats()}
+
+async def start_metrics():
+    # Metrics are optional, a port already in use must not keep the bot from starting
+    if not METRICS_PORT:
+        return None
+    try:
+        return await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    except OSError as e:
+        logging.error(f"Failed to start the metrics server on port {METRICS_PORT}: {e}")
+        return None
+
+def log_startup_time():
+    logging.info(f"Bot ready in {time.perf_counter() - started_at:.2f}s")
+
+async def on_webhook_startup(bot: Bot):
+    await db.warm_up()
+    outbox.restore()
+    broadcaster.resume()
+    log_startup_time()
+    if WEBHOOK_BASE_URL:
+        await bot.set_webhook(f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET or None)
+
+def create_webhook_app():
+    dp.startup.register(on_webhook_startup)
+    app = create_app(
+        dp, bot, WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        health=health_status,
+        on_drained=[shutdown_services]
+    )
+
+    async def start_app_metrics(app):
+        app['metrics_runner'] = await start_metrics()
+
+    async def stop_app_metrics(app):
+        if app['metrics_runner']:
+            await app['metrics_runner'].cleanup()
+
+    app.on_startup.append(start_app_metrics)
+    app.on_cleanup.append(stop_app_metrics)
+    return app
+
 async def main():
-    await dp.start_polling(bot)
+    await db.warm_up()
+    outbox.restore()
+    broadcaster.resume()
+    metrics_runner = await start_metrics()
+    log_startup_time()
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await shutdown_services()
+        if metrics_runner:
+            await metrics_runner.cleanup()
 
 if __name__ == '__main__':
-    import asyncio
-    asyncio.run(main()) 
\ No newline at end of file
+    if RUN_MODE == 'webhook':
+        web.run_app(create_webhook_app(), host=WEBAPP_HOST, port=WEBAPP_PORT)
+    else:
+        import asyncio
+        asyncio.run(main())
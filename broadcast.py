@@ -0,0 +1,200 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+from ratelimit import TokenBucket
+
+MAX_NETWORK_RETRIES = 3
+SAVE_EVERY = 50
+PROGRESS_INTERVAL = 10
+
+
+def parse_audience(args):
+    # "/broadcast floor=3 department=IT text..." -> ({'floor': '3', 'department': 'IT'}, "text...")
+    filters = {}
+    words = (args or "").split(' ')
+    while words and '=' in words[0] and words[0].split('=', 1)[0] in ('floor', 'department'):
+        key, value = words.pop(0).split('=', 1)
+        filters[key] = value.replace('_', ' ')
+    return filters, ' '.join(words).strip()
+
+
+def progress_text(job):
+    done = job['sent'] + job['blocked'] + job['failed']
+    state = "yakunlandi" if done >= len(job['recipients']) else "yuborilmoqda"
+    if job.get('cancelled'):
+        state = "to'xtatildi"
+    return (
+        f"Xabarnoma {job['id']} {state}: {done}/{len(job['recipients'])}\n"
+        f"Yuborildi: {job['sent']}, botni bloklagan: {job['blocked']}, xato: {job['failed']}"
+    )
+
+
+# Sends one text to many users through a pool of workers sharing a rate limit
+# (and the outbox's global Telegram limit). Progress is kept in a JSON state
+# file, saved every SAVE_EVERY recipients and every PROGRESS_INTERVAL seconds,
+# so unfinished broadcasts continue after a restart, and users who blocked the
+# bot are remembered and skipped until they write to it again (see unblock()).
+class Broadcaster:
+    def __init__(self, bot, outbox, state_path, messages_per_second, workers):
+        self.bot = bot
+        self.outbox = outbox
+        self._state_path = state_path
+        self._bucket = TokenBucket(messages_per_second * 60, 1)
+        self._workers = workers
+        self._jobs = {}
+        self._tasks = {}
+        self.blocked = set()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self._state_path):
+            return
+        try:
+            with open(self._state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to read broadcast state from {self._state_path}: {e}")
+            return
+        self.blocked = set(state.get('blocked', []))
+        self._jobs = {job['id']: job for job in state.get('jobs', [])}
+
+    def _save(self):
+        tmp_path = self._state_path + '.tmp'
+        state = {
+            'blocked': sorted(self.blocked),
+            'jobs': [dict(job, done=sorted(job['done'])) for job in self._jobs.values()]
+        }
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self._state_path)
+        except OSError as e:
+            logging.error(f"Failed to save broadcast state: {e}")
+
+    def start(self, text, recipients, chat_id, message_id):
+        # chat_id/message_id: the message that shows the progress
+        job_id = time.strftime("%Y%m%d%H%M%S")
+        while job_id in self._jobs:
+            job_id += "_"
+        recipients = [str(user_id) for user_id in dict.fromkeys(recipients) if str(user_id) not in self.blocked]
+        job = {
+            'id': job_id, 'text': text, 'recipients': recipients, 'done': set(),
+            'chat_id': chat_id, 'message_id': message_id, 'sent': 0, 'blocked': 0, 'failed': 0
+        }
+        self._jobs[job_id] = job
+        self._save()
+        self._tasks[job_id] = asyncio.create_task(self._run(job))
+        return job
+
+    def unblock(self, user_id):
+        # The user talks to the bot again, so they can be sent broadcasts again
+        user_id = str(user_id)
+        if user_id not in self.blocked:
+            return False
+        self.blocked.discard(user_id)
+        self._save()
+        logging.info(f"User {user_id} no longer blocks the bot")
+        return True
+
+    def resume(self):
+        for job in self._jobs.values():
+            job['done'] = set(job['done'])
+            if job['id'] not in self._tasks:
+                logging.info(f"Resuming broadcast {job['id']}: {len(job['done'])}/{len(job['recipients'])} done")
+                self._tasks[job['id']] = asyncio.create_task(self._run(job))
+
+    def cancel(self, job_id=None):
+        # Cancels the given broadcast, or all of them
+        job_ids = [job_id] if job_id else list(self._tasks)
+        for job_id in job_ids:
+            task = self._tasks.get(job_id)
+            if task is not None:
+                self._jobs[job_id]['cancelled'] = True
+                task.cancel()
+        return [job_id for job_id in job_ids if job_id in self._tasks]
+
+    async def _send(self, job, user_id):
+        network_errors = 0
+        while True:
+            await self._bucket.acquire()
+            await self.outbox.reserve()
+            try:
+                await self.bot.send_message(chat_id=int(user_id), text=job['text'])
+                job['sent'] += 1
+                return
+            except TelegramRetryAfter as e:
+                logging.warning(f"Flood limit hit during broadcast {job['id']}, retrying after {e.retry_after}s")
+                self.outbox.pause(e.retry_after)
+            except TelegramForbiddenError:
+                self.blocked.add(user_id)
+                job['blocked'] += 1
+                return
+            except TelegramNetworkError as e:
+                network_errors += 1
+                if network_errors > MAX_NETWORK_RETRIES:
+                    logging.error(f"Failed to send broadcast to {user_id}: {e}")
+                    job['failed'] += 1
+                    return
+                await asyncio.sleep(network_errors)
+            except Exception as e:
+                # Any other error, e.g. an invalid ID, only fails this recipient
+                logging.error(f"Failed to send broadcast to {user_id}: {e}")
+                job['failed'] += 1
+                return
+
+    async def _worker(self, job, queue):
+        while queue:
+            user_id = queue.pop()
+            await self._send(job, user_id)
+            job['done'].add(user_id)
+            if len(job['done']) % SAVE_EVERY == 0:
+                self._save()
+
+    async def _report(self, job):
+        last_text = None
+        while True:
+            text = progress_text(job)
+            if text != last_text:
+                await self.outbox.edit_text(job['chat_id'], job['message_id'], text)
+                last_text = text
+                # Saved with every report too, so after a crash at most one
+                # interval of messages is sent again
+                self._save()
+            await asyncio.sleep(PROGRESS_INTERVAL)
+
+    async def _run(self, job):
+        queue = [user_id for user_id in reversed(job['recipients']) if user_id not in job['done']]
+        reporter = asyncio.create_task(self._report(job))
+        started = time.monotonic()
+        try:
+            await asyncio.gather(*(self._worker(job, queue) for _ in range(self._workers)))
+        except asyncio.CancelledError:
+            if not job.get('cancelled'):
+                # Shutting down, continue after the restart
+                self._save()
+                raise
+        finally:
+            reporter.cancel()
+        await self.outbox.edit_text(job['chat_id'], job['message_id'], progress_text(job))
+        logging.info(f"Broadcast {job['id']} finished in {time.monotonic() - started:.0f}s: "
+                     f"{job['sent']} sent, {job['blocked']} blocked, {job['failed']} failed")
+        del self._jobs[job['id']]
+        del self._tasks[job['id']]
+        self._save()
+
+    async def close(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = {}
+
+    def stats(self):
+        return {
+            'running': len(self._tasks),
+            'queued': sum(len(job['recipients']) - len(job['done']) for job in self._jobs.values()),
+            'blocked_users': len(self.blocked)
+        }
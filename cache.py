@@ -0,0 +1,250 @@
+import asyncio
+import bisect
+import logging
+import time
+
+
+def row_to_user(row):
+    return {
+        'name': row[0],
+        'phone': row[1],
+        'department': row[2],
+        'floor': row[3],
+        'telegram_id': row[4],
+        'username': row[5] if len(row) > 5 else ""
+    }
+
+
+# In-memory copy of the Users sheet keyed by Telegram ID.
+# Loaded on first lookup, then refreshed in the background once the TTL expires.
+class UserDirectory:
+    def __init__(self, loader, ttl):
+        self._loader = loader
+        self._ttl = ttl
+        self._users = {}
+        self._loaded_at = None
+        self._unsaved = {}
+        # Telegram IDs that have a row in the sheet
+        self._in_sheet = set()
+        self._lock = asyncio.Lock()
+        self._refresh_task = None
+        self.row_count = 0
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, rows):
+        self.row_count = len(rows)
+        users = {}
+        # Skip header row
+        for row in rows[1:]:
+            if len(row) > 4:
+                users[str(row[4]).strip()] = row_to_user(row)
+        self._in_sheet = set(users)
+        # Registrations still waiting to be written are not in the sheet yet
+        for telegram_id, user in self._unsaved.items():
+            users.setdefault(telegram_id, user)
+        self._users = users
+        self._loaded_at = time.monotonic()
+        logging.info(f"User directory loaded: {len(users)} users")
+
+    async def refresh(self):
+        async with self._lock:
+            self.load(await self._loader())
+
+    async def _refresh_in_background(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logging.error(f"Failed to refresh user directory: {e}")
+
+    def is_stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self._ttl
+
+    async def get(self, telegram_id):
+        if self._loaded_at is None:
+            async with self._lock:
+                if self._loaded_at is None:
+                    self.load(await self._loader())
+        elif self.is_stale() and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.create_task(self._refresh_in_background())
+
+        user = self._users.get(str(telegram_id).strip())
+        if user is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(user)
+
+    async def all(self):
+        if self._loaded_at is None:
+            async with self._lock:
+                if self._loaded_at is None:
+                    self.load(await self._loader())
+        return [dict(user) for user in self._users.values()]
+
+    def add(self, row, saved=True):
+        # Store values the way the Sheets API returns them
+        row = [str(value) for value in row]
+        telegram_id = row[4].strip()
+        self._users[telegram_id] = row_to_user(row)
+        if saved:
+            self._in_sheet.add(telegram_id)
+        else:
+            self._unsaved[telegram_id] = self._users[telegram_id]
+
+    def add_rows(self, first_row, rows):
+        # Rows read from the sheet, starting at row number first_row
+        for row in rows:
+            if len(row) > 4:
+                self.add(row)
+        self.note_rows(first_row + len(rows) - 1)
+
+    def note_rows(self, last_row):
+        self.row_count = max(self.row_count, last_row)
+
+    def mark_saved(self, telegram_id):
+        self._unsaved.pop(str(telegram_id).strip(), None)
+        self._in_sheet.add(str(telegram_id).strip())
+
+    def contains(self, telegram_id):
+        return str(telegram_id).strip() in self._users
+
+    def in_sheet(self, telegram_id):
+        return str(telegram_id).strip() in self._in_sheet
+
+    def stats(self):
+        return {'size': len(self._users), 'hits': self.hits, 'misses': self.misses}
+
+
+def row_to_request(row):
+    return {
+        'request_id': row[0],
+        'user_id': row[1],
+        'name': row[2],
+        'department': row[3],
+        'floor': row[4],
+        'topic': row[5],
+        'description': row[6],
+        'date': row[7],
+        'status': row[8] if len(row) > 8 else "Pending",
+        'accepted_by': row[9] if len(row) > 9 else "",
+        'accepted_at': row[10] if len(row) > 10 else "",
+        'solved_at': row[11] if len(row) > 11 else ""
+    }
+
+
+def _as_request(row):
+    return row_to_request(row) if row is not None and len(row) > 7 else None
+
+
+# Maps request_id to its sheet row number and the cached row contents,
+# so status updates can write straight to Requests!I{n}:L{n}.
+# Requests that are not written to the sheet yet have no row number.
+# Every change is also passed to `stats` (a dashboard.RequestStats).
+class RequestIndex:
+    def __init__(self, loader, stats=None):
+        self._loader = loader
+        self._stats = stats
+        self._rows = {}
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        # Changes whenever row numbers may have shifted
+        self.generation = 0
+        # Counts status changes made here; _touched has the count after each request's last change
+        self.version = 0
+        self._touched = {}
+
+    def load(self, rows):
+        index = {}
+        # Skip header row, data starts at row 2
+        for row_number, row in enumerate(rows[1:], start=2):
+            if row:
+                index[str(row[0]).strip()] = (row_number, list(row))
+        for request_id, (row_number, row) in self._rows.items():
+            if row_number is None:
+                index.setdefault(request_id, (None, row))
+        self._rows = index
+        self._loaded = True
+        self.generation += 1
+        if self._stats is not None:
+            self._stats.load(filter(None, (_as_request(row) for _, row in index.values())))
+        logging.info(f"Request index loaded: {len(index)} requests")
+
+    async def refresh(self):
+        async with self._lock:
+            self.load(await self._loader())
+
+    def locked(self):
+        # Held while rows are reloaded or moved so row numbers stay consistent
+        return self._lock
+
+    async def ensure_loaded(self):
+        if not self._loaded:
+            async with self._lock:
+                if not self._loaded:
+                    self.load(await self._loader())
+
+    def get(self, request_id):
+        return self._rows.get(str(request_id).strip())
+
+    def _changed(self, old_row, new_row):
+        if self._stats is not None:
+            self._stats.update(_as_request(old_row), _as_request(new_row))
+
+    def add(self, row_number, row):
+        row = [str(value) for value in row]
+        previous = self._rows.get(row[0].strip())
+        self._rows[row[0].strip()] = (row_number, row)
+        self._changed(previous[1] if previous else None, row)
+
+    def changed_since(self, request_id, version):
+        # True if the request's status was changed here after `version`
+        return self._touched.get(str(request_id).strip(), 0) > version
+
+    def remove(self, request_id):
+        self._touched.pop(str(request_id).strip(), None)
+        previous = self._rows.pop(str(request_id).strip(), None)
+        if previous:
+            self._changed(previous[1], None)
+
+    def remove_rows(self, row_numbers):
+        # Rows deleted from the sheet, the rows below them move up
+        deleted = sorted(row_numbers)
+        rows = {}
+        for request_id, (row_number, row) in self._rows.items():
+            if row_number is None:
+                rows[request_id] = (None, row)
+            elif row_number not in row_numbers:
+                rows[request_id] = (row_number - bisect.bisect_left(deleted, row_number), row)
+            else:
+                self._touched.pop(request_id, None)
+                self._changed(row, None)
+        self._rows = rows
+        self.generation += 1
+
+    def last_row(self):
+        return max((row_number for row_number, _ in self._rows.values() if row_number), default=1)
+
+    def by_row(self):
+        return {row_number: row for row_number, row in self._rows.values() if row_number}
+
+    def set_row_number(self, request_id, row_number):
+        _, row = self._rows[str(request_id).strip()]
+        self._rows[str(request_id).strip()] = (row_number, row)
+
+    def set_status(self, request_id, status, accepted_by, changed_at=None):
+        row_number, previous = self._rows[str(request_id).strip()]
+        row = previous + [""] * (12 - len(previous))
+        row[8] = status
+        row[9] = accepted_by
+        if changed_at and status == "Accepted":
+            row[10] = changed_at
+        elif changed_at and status == "Solved":
+            row[11] = changed_at
+        self._rows[str(request_id).strip()] = (row_number, row)
+        self.version += 1
+        self._touched[str(request_id).strip()] = self.version
+        self._changed(previous, row)
+
+    def __len__(self):
+        return len(self._rows)
@@ -8,11 +8,122 @@ load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 GROUP_CHAT_ID = os.getenv('GROUP_CHAT_ID')
 
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+
+# Telegram IDs allowed to use /broadcast in the group, comma separated (empty: everyone in the group)
+ADMIN_IDS = [int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()]
+
+# Prometheus metrics endpoint, off unless METRICS_PORT is set (9090 is taken by
+# Prometheus itself). Kept apart from the webhook server, which usually listens
+# on a public address.
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+
+# Update delivery: 'polling' or 'webhook'. In webhook mode Telegram posts updates
+# to WEBHOOK_BASE_URL + WEBHOOK_PATH and the bot listens on WEBAPP_HOST:WEBAPP_PORT.
+RUN_MODE = os.getenv('RUN_MODE', 'polling')
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', 8080))
+
+# Sharded mode (python shards.py): SHARDS worker processes share the work.
+# SHARD_INDEX is set by shards.py for each worker.
+SHARDS = max(int(os.getenv('SHARDS', 1)), 1)
+SHARD_INDEX = int(os.getenv('SHARD_INDEX', 0))
+
+# Conversation state storage: 'sqlite' (default), 'redis' or 'memory'.
+# States untouched for FSM_TTL seconds are discarded.
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
+FSM_SQLITE_PATH = os.getenv('FSM_SQLITE_PATH', 'fsm.db')
+FSM_TTL = int(os.getenv('FSM_TTL', 86400))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+# Telegram flood limits for outgoing messages
+TELEGRAM_MESSAGES_PER_SECOND = int(os.getenv('TELEGRAM_MESSAGES_PER_SECOND', 30))
+TELEGRAM_GROUP_MESSAGES_PER_MINUTE = int(os.getenv('TELEGRAM_GROUP_MESSAGES_PER_MINUTE', 20))
+TELEGRAM_CHAT_MESSAGES_PER_SECOND = int(os.getenv('TELEGRAM_CHAT_MESSAGES_PER_SECOND', 1))
+# Messages still queued on shutdown are kept here and sent after the next start
+OUTBOX_SPOOL_FILE = os.getenv('OUTBOX_SPOOL_FILE', 'outbox.jsonl')
+
+# Broadcasts: messages per second (kept below the global limit so regular
+# messages still get through), concurrent senders and the progress file
+BROADCAST_MESSAGES_PER_SECOND = int(os.getenv('BROADCAST_MESSAGES_PER_SECOND', 20))
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', 8))
+BROADCAST_STATE_FILE = os.getenv('BROADCAST_STATE_FILE', 'broadcasts.json')
+
+# A request with the same topic and description as one created by the same user,
+# or on the same floor, in the last DUPLICATE_WINDOW seconds is linked to that
+# request instead of creating a new one (0 disables)
+DUPLICATE_WINDOW = int(os.getenv('DUPLICATE_WINDOW', 600))
+DUPLICATE_CACHE_SIZE = int(os.getenv('DUPLICATE_CACHE_SIZE', 1000))
+
 # Google Sheets settings
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
 GOOGLE_SHEETS_CREDENTIALS_FILE = os.getenv('GOOGLE_SHEETS_CREDENTIALS_FILE')
 
+# Storage backend: 'sheets' or 'sqlite'. With SQLite the Google Sheets copy
+# can still be kept up to date in the background for staff.
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sheets')
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'bot.db')
+SQLITE_MIRROR_TO_SHEETS = os.getenv('SQLITE_MIRROR_TO_SHEETS', 'false').lower() == 'true'
+# Copy users and requests from Google Sheets on the first start with an empty
+# SQLite database, so switching an existing deployment to SQLite keeps its data
+SQLITE_IMPORT_FROM_SHEETS = os.getenv(
+    'SQLITE_IMPORT_FROM_SHEETS', 'true' if SPREADSHEET_ID and GOOGLE_SHEETS_CREDENTIALS_FILE else 'false'
+).lower() == 'true'
+
+# Cache settings (seconds)
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 300))
+
+# Google Sheets I/O settings
+SHEETS_MAX_WORKERS = int(os.getenv('SHEETS_MAX_WORKERS', 4))
+SHEETS_TIMEOUT = float(os.getenv('SHEETS_TIMEOUT', 15))
+
+# Google Sheets quota handling: requests per minute (the default per-user quota
+# is 60 reads and 60 writes), burst size, retries and circuit breaker
+SHEETS_READS_PER_MINUTE = int(os.getenv('SHEETS_READS_PER_MINUTE', 60))
+SHEETS_WRITES_PER_MINUTE = int(os.getenv('SHEETS_WRITES_PER_MINUTE', 60))
+SHEETS_BURST = int(os.getenv('SHEETS_BURST', 10))
+SHEETS_MAX_RETRIES = int(os.getenv('SHEETS_MAX_RETRIES', 4))
+SHEETS_BREAKER_THRESHOLD = int(os.getenv('SHEETS_BREAKER_THRESHOLD', 5))
+SHEETS_BREAKER_RESET = float(os.getenv('SHEETS_BREAKER_RESET', 30))
+
+# Re-read a request's status row before changing it, so clicks already handled
+# by another bot process writing to the same sheet are seen. Best effort only:
+# the read and the later write are separate calls, so two processes handling
+# clicks at the same moment can both succeed. Sharded mode (shards.py) avoids
+# this by sending all clicks on one request to the same worker.
+CHECK_SHEET_BEFORE_UPDATE = os.getenv('CHECK_SHEET_BEFORE_UPDATE', 'false').lower() == 'true'
+
+# Write-behind settings: writes are batched for WRITE_BATCH_WINDOW seconds
+# or until WRITE_BATCH_SIZE operations are pending
+WRITE_BATCH_WINDOW = float(os.getenv('WRITE_BATCH_WINDOW', 0.2))
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', 50))
+WRITE_SPOOL_FILE = os.getenv('WRITE_SPOOL_FILE', 'pending_writes.jsonl')
+
+# Incremental sync of edits made directly in the spreadsheet, every SYNC_INTERVAL
+# seconds (0 disables it). Request IDs and statuses are read for the whole
+# sheet, so each sync costs more as the sheet grows; blocks of SYNC_CHUNK_ROWS
+# rows that differ are re-read in full. With SYNC_USE_DRIVE the sheets are only
+# read after the file's Drive modifiedTime changes (needs the Drive API enabled
+# for the account). The bot's own writes change it too, so this only saves reads
+# while the bot is idle.
+SYNC_INTERVAL = int(os.getenv('SYNC_INTERVAL', 60))
+SYNC_CHUNK_ROWS = int(os.getenv('SYNC_CHUNK_ROWS', 500))
+SYNC_USE_DRIVE = os.getenv('SYNC_USE_DRIVE', 'false').lower() == 'true'
+if SYNC_USE_DRIVE:
+    SCOPES.append('https://www.googleapis.com/auth/drive.metadata.readonly')
+
+# Solved requests older than ARCHIVE_AFTER_DAYS days are moved out of the
+# Requests sheet into Requests_YYYY_MM sheets (0 disables archiving). The
+# archiver runs every ARCHIVE_INTERVAL seconds, moving ARCHIVE_BATCH_SIZE rows at a time.
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 0))
+ARCHIVE_INTERVAL = int(os.getenv('ARCHIVE_INTERVAL', 3600))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 500))
+
 # Predefined topics
 TOPICS = [
     "Internet",
@@ -24,4 +135,20 @@ TOPICS = [
 
 # Sheet ranges
 USERS_RANGE = 'Users!A:G'
-REQUESTS_RANGE = 'Requests!A:J' 
\ No newline at end of file
+REQUESTS_RANGE = 'Requests!A:L'
+
+# In a shard worker the Telegram and Google Sheets limits are shared by all
+# workers, local files get the shard number and metrics use one port per worker.
+# Archiving shifts row numbers under the other workers, so it is left off.
+if SHARDS > 1:
+    TELEGRAM_MESSAGES_PER_SECOND = max(TELEGRAM_MESSAGES_PER_SECOND // SHARDS, 1)
+    TELEGRAM_GROUP_MESSAGES_PER_MINUTE = max(TELEGRAM_GROUP_MESSAGES_PER_MINUTE // SHARDS, 1)
+    BROADCAST_MESSAGES_PER_SECOND = max(BROADCAST_MESSAGES_PER_SECOND // SHARDS, 1)
+    SHEETS_READS_PER_MINUTE = max(SHEETS_READS_PER_MINUTE // SHARDS, 1)
+    SHEETS_WRITES_PER_MINUTE = max(SHEETS_WRITES_PER_MINUTE // SHARDS, 1)
+    SHEETS_BURST = max(SHEETS_BURST // SHARDS, 1)
+    WRITE_SPOOL_FILE = f"{WRITE_SPOOL_FILE}.{SHARD_INDEX}"
+    BROADCAST_STATE_FILE = f"{BROADCAST_STATE_FILE}.{SHARD_INDEX}"
+    OUTBOX_SPOOL_FILE = f"{OUTBOX_SPOOL_FILE}.{SHARD_INDEX}"
+    METRICS_PORT = METRICS_PORT + SHARD_INDEX if METRICS_PORT else 0
+    ARCHIVE_AFTER_DAYS = 0 
\ No newline at end of file
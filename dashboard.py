@@ -0,0 +1,107 @@
+from collections import Counter
+from datetime import datetime
+from config import TOPICS
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _seconds_between(start, end):
+    try:
+        return (datetime.strptime(end, DATE_FORMAT) - datetime.strptime(start, DATE_FORMAT)).total_seconds()
+    except (TypeError, ValueError):
+        return None
+
+
+# Counters behind /stats and /queue, kept up to date as requests are added or
+# change status so the commands never scan the requests. Takes request dicts
+# as returned by get_request_data.
+class RequestStats:
+    def __init__(self):
+        self.load([])
+
+    def load(self, requests):
+        self.by_status = Counter()
+        self.open_by_topic = Counter()
+        self.open_by_floor = Counter()
+        self.open_by_assignee = Counter()
+        self.accept_seconds = 0.0
+        self.accepted = 0
+        self.solve_seconds = 0.0
+        self.solved = 0
+        for request in requests:
+            self._apply(request, 1)
+
+    def _apply(self, request, sign):
+        status = request['status'] or "Pending"
+        self.by_status[status] += sign
+        if status != "Solved":
+            self.open_by_topic[request['topic']] += sign
+            self.open_by_floor[str(request['floor'])] += sign
+            if status == "Accepted":
+                self.open_by_assignee[request['accepted_by'] or "-"] += sign
+        accept_seconds = _seconds_between(request['date'], request.get('accepted_at'))
+        if accept_seconds is not None:
+            self.accept_seconds += sign * accept_seconds
+            self.accepted += sign
+        solve_seconds = _seconds_between(request['date'], request.get('solved_at'))
+        if solve_seconds is not None:
+            self.solve_seconds += sign * solve_seconds
+            self.solved += sign
+
+    def update(self, old, new):
+        # old is None for new requests, new is None for removed ones
+        if old is not None:
+            self._apply(old, -1)
+        if new is not None:
+            self._apply(new, 1)
+
+    def snapshot(self):
+        return {
+            'by_status': {status: count for status, count in self.by_status.items() if count},
+            'open_by_topic': {topic: self.open_by_topic.get(topic, 0) for topic in TOPICS},
+            'open_by_floor': {floor: count for floor, count in sorted(self.open_by_floor.items()) if count},
+            'open_by_assignee': {name: count for name, count in self.open_by_assignee.most_common() if count},
+            'avg_accept_seconds': self.accept_seconds / self.accepted if self.accepted else None,
+            'avg_solve_seconds': self.solve_seconds / self.solved if self.solved else None
+        }
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "-"
+    minutes = int(seconds // 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours} soat {minutes} daqiqa"
+    return f"{minutes} daqiqa"
+
+
+def _lines(counts):
+    return [f"  {name}: {count}" for name, count in counts.items()] or ["  -"]
+
+
+def format_stats(snapshot):
+    by_status = snapshot['by_status']
+    return "\n".join([
+        "Statistika:",
+        f"Jami: {sum(by_status.values())}",
+        f"Kutilmoqda: {by_status.get('Pending', 0)}",
+        f"Qabul qilingan: {by_status.get('Accepted', 0)}",
+        f"Hal qilingan: {by_status.get('Solved', 0)}",
+        "",
+        f"O'rtacha qabul qilish vaqti: {format_duration(snapshot['avg_accept_seconds'])}",
+        f"O'rtacha hal qilish vaqti: {format_duration(snapshot['avg_solve_seconds'])}"
+    ])
+
+
+def format_queue(snapshot):
+    by_status = snapshot['by_status']
+    open_count = by_status.get('Pending', 0) + by_status.get('Accepted', 0)
+    return "\n".join(
+        [f"Ochiq so'rovlar: {open_count} (kutilmoqda: {by_status.get('Pending', 0)})", "", "Mavzu bo'yicha:"]
+        + _lines({topic: count for topic, count in snapshot['open_by_topic'].items() if count})
+        + ["", "Qavat bo'yicha:"]
+        + _lines(snapshot['open_by_floor'])
+        + ["", "Mas'ul bo'yicha:"]
+        + _lines(snapshot['open_by_assignee'])
+    )
@@ -1,171 +1,600 @@
+import asyncio
 import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import httplib2
 from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from config import SCOPES, SPREADSHEET_ID, GOOGLE_SHEETS_CREDENTIALS_FILE, USERS_RANGE, REQUESTS_RANGE
+from config import (SCOPES, SPREADSHEET_ID, GOOGLE_SHEETS_CREDENTIALS_FILE, USERS_RANGE, REQUESTS_RANGE,
+                    USER_CACHE_TTL, SHEETS_MAX_WORKERS, SHEETS_TIMEOUT, WRITE_BATCH_WINDOW, WRITE_BATCH_SIZE,
+                    WRITE_SPOOL_FILE, STORAGE_BACKEND, SQLITE_PATH, SQLITE_MIRROR_TO_SHEETS, SHEETS_READS_PER_MINUTE,
+                    SHEETS_WRITES_PER_MINUTE, SHEETS_BURST, SHEETS_MAX_RETRIES, SHEETS_BREAKER_THRESHOLD,
+                    SHEETS_BREAKER_RESET, CHECK_SHEET_BEFORE_UPDATE, SYNC_INTERVAL, SYNC_CHUNK_ROWS,
+                    SYNC_USE_DRIVE, ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL, ARCHIVE_BATCH_SIZE,
+                    SQLITE_IMPORT_FROM_SHEETS)
+from storage import Storage, UNAVAILABLE
+from cache import UserDirectory, RequestIndex, row_to_request
+from dashboard import RequestStats
+from writer import WriteQueue
+from sync import IncrementalSync
+import events
+from archive import Archiver, ARCHIVE_PREFIX
+from ratelimit import TokenBucket, CircuitBreaker, CircuitOpenError, backoff_delay
+from metrics import instrument_storage, count_rows, sheets_duration, sheets_rows, sheets_errors
 
-class Database:
+SHEETS_ERRORS = (HttpError, OSError, CircuitOpenError)
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+class Database(Storage):
     def __init__(self):
         self.service = None
+        self.credentials = None
+        # googleapiclient is blocking and httplib2 is not thread-safe, so calls
+        # run on a bounded pool with one HTTP connection per worker thread
+        self._executor = ThreadPoolExecutor(max_workers=SHEETS_MAX_WORKERS, thread_name_prefix='sheets')
+        self._local = threading.local()
+        # Calls that timed out but whose thread is still running
+        self._abandoned = set()
+        # Rows ('user', telegram_id) or ('request', request_id) whose append
+        # failed without a reply, they may be in the sheet already
+        self._unconfirmed = set()
+        self.read_limiter = TokenBucket(SHEETS_READS_PER_MINUTE, SHEETS_BURST)
+        self.write_limiter = TokenBucket(SHEETS_WRITES_PER_MINUTE, SHEETS_BURST)
+        self.breaker = CircuitBreaker(SHEETS_BREAKER_THRESHOLD, SHEETS_BREAKER_RESET)
+        self.users = UserDirectory(self._load_users, USER_CACHE_TTL)
+        self.aggregates = RequestStats()
+        self.requests = RequestIndex(self._load_requests, self.aggregates)
+        self.writes = WriteQueue(self._flush_writes, WRITE_SPOOL_FILE, WRITE_BATCH_WINDOW, WRITE_BATCH_SIZE,
+                                 retry_delay=self.breaker.remaining)
+        self.drive = None
+        self._warm_up_task = None
         self._initialize_service()
+        self.sync = IncrementalSync(self, SPREADSHEET_ID, SYNC_INTERVAL, SYNC_CHUNK_ROWS, self.drive)
+        self.archiver = Archiver(self, SPREADSHEET_ID, ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL, ARCHIVE_BATCH_SIZE)
+        events.on('user', self._apply_user_event)
+        events.on('request', self._apply_request_event)
+        events.on('requests_saved', self._apply_requests_saved_event)
+        events.on('status', self._apply_status_event)
 
     def _initialize_service(self):
+        started = time.perf_counter()
         try:
-            creds = service_account.Credentials.from_service_account_file(
+            self.credentials = service_account.Credentials.from_service_account_file(
                 GOOGLE_SHEETS_CREDENTIALS_FILE, scopes=SCOPES)
-            self.service = build('sheets', 'v4', credentials=creds)
+            self.service = build('sheets', 'v4', credentials=self.credentials)
+            if SYNC_USE_DRIVE:
+                self.drive = build('drive', 'v3', credentials=self.credentials)
+            logging.info(f"Google Sheets client built in {(time.perf_counter() - started) * 1000:.0f} ms")
         except Exception as e:
             logging.error(f"Failed to initialize Google Sheets service: {e}")
             raise
 
-    async def get_user_data(self, telegram_id):
+    def _http(self):
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=SHEETS_TIMEOUT))
+            self._local.http = http
+        return http
+
+    async def _call(self, request):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, lambda: request.execute(http=self._http()))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), SHEETS_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.error(f"Google Sheets call timed out after {SHEETS_TIMEOUT}s")
+            # The thread keeps going and the call may still be applied
+            self._abandoned.add(future)
+            future.add_done_callback(self._forget_call)
+            raise
+
+    def _forget_call(self, future):
+        self._abandoned.discard(future)
+        if not future.cancelled():
+            future.exception()
+
+    async def _execute(self, request, write=False):
+        operation = getattr(request, 'methodId', 'unknown').replace('sheets.spreadsheets.', '')
+        started = time.perf_counter()
+        try:
+            result = await self._execute_with_retries(request, write)
+        except Exception:
+            sheets_errors.inc(operation)
+            raise
+        finally:
+            sheets_duration.observe(operation, value=time.perf_counter() - started)
+        sheets_rows.inc(operation, amount=count_rows(result))
+        return result
+
+    async def _execute_with_retries(self, request, write):
+        limiter = self.write_limiter if write else self.read_limiter
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError("Google Sheets is unavailable")
+            await limiter.acquire()
+            try:
+                result = await self._call(request)
+            except (HttpError, OSError) as error:
+                if isinstance(error, HttpError) and error.resp.status not in RETRYABLE_STATUSES:
+                    # The request itself is wrong, Sheets is fine
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                # A write that timed out may still have been applied, retrying an append would duplicate the row
+                if attempt >= SHEETS_MAX_RETRIES or (write and not isinstance(error, HttpError)):
+                    raise
+                delay = backoff_delay(attempt, 0.5, 16)
+                logging.warning(f"Google Sheets call failed ({error}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+            else:
+                self.breaker.record_success()
+                return result
+
+    async def _load_users(self):
+        result = await self._execute(self.service.spreadsheets().values().get(
+            spreadsheetId=SPREADSHEET_ID,
+            range=USERS_RANGE
+        ))
+        return result.get('values', [])
+
+    async def _load_requests(self):
+        result = await self._execute(self.service.spreadsheets().values().get(
+            spreadsheetId=SPREADSHEET_ID,
+            range=REQUESTS_RANGE
+        ))
+        return result.get('values', [])
+
+    async def _load_indexes(self):
+        # Load both sheets with a single batchGet
         try:
-            result = self.service.spreadsheets().values().get(
+            result = await self._execute(self.service.spreadsheets().values().batchGet(
                 spreadsheetId=SPREADSHEET_ID,
-                range=USERS_RANGE
-            ).execute()
-            values = result.get('values', [])
-            
-            for row in values:
-                if str(row[4]) == str(telegram_id):  # Check Telegram ID
-                    return {
-                        'name': row[0],
-                        'phone': row[1],
-                        'department': row[2],
-                        'floor': row[3],
-                        'telegram_id': row[4],
-                        'username': row[5]
-                    }
-            return None
-        except HttpError as error:
+                ranges=[USERS_RANGE, REQUESTS_RANGE]
+            ))
+        except SHEETS_ERRORS as error:
+            logging.error(f"An error occurred while loading indexes: {error}")
+            return False
+        users_range, requests_range = result.get('valueRanges', [{}, {}])
+        self.users.load(users_range.get('values', []))
+        self.requests.load(requests_range.get('values', []))
+        self.writes.restore(self._restore_write)
+        if SYNC_INTERVAL > 0:
+            self.sync.start()
+        if ARCHIVE_AFTER_DAYS > 0:
+            self.archiver.start()
+        return True
+
+    async def read_all(self):
+        # All users and requests, archived ones included, without the header rows
+        titles = [title for title in await self.archiver.sheet_ids() if title.startswith(ARCHIVE_PREFIX)]
+        result = await self._execute(self.service.spreadsheets().values().batchGet(
+            spreadsheetId=SPREADSHEET_ID,
+            ranges=[USERS_RANGE, REQUESTS_RANGE] + [f"{title}!A:L" for title in titles]
+        ))
+        value_ranges = [value_range.get('values', []) for value_range in result.get('valueRanges', [])]
+        users = value_ranges[0][1:] if value_ranges else []
+        requests = [row for rows in value_ranges[1:] for row in rows[1:]]
+        return users, requests
+
+    async def warm_up(self):
+        # Load the indexes before the first update arrives
+        started = time.perf_counter()
+        if not await self._load_indexes():
+            # Writes left in the spool are restored once the sheets can be read
+            self._warm_up_task = asyncio.create_task(self._retry_warm_up())
+            return
+        logging.info(f"Warm-up finished in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    async def _retry_warm_up(self):
+        attempt = 0
+        while True:
+            await asyncio.sleep(backoff_delay(attempt, 1, SHEETS_BREAKER_RESET))
+            attempt += 1
+            if await self._load_indexes():
+                logging.info(f"Warm-up finished after {attempt} retries")
+                return
+
+    async def close(self):
+        if self._warm_up_task is not None:
+            self._warm_up_task.cancel()
+        await self.sync.stop()
+        await self.archiver.stop()
+        await self.writes.stop()
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            'users': self.users.stats(),
+            'requests': len(self.requests),
+            'pending_writes': len(self.writes.pending()),
+            'archive': self.archiver.stats(),
+            'sheets_available': not self.breaker.is_open(),
+            'read_limiter': self.read_limiter.stats(),
+            'write_limiter': self.write_limiter.stats()
+        }
+
+    async def _find_request(self, request_id, archived=False):
+        await self.requests.ensure_loaded()
+        entry = self.requests.get(request_id)
+        if entry is None and archived and not self.breaker.is_open():
+            # Old requests live in the sheet of their month and have no row in
+            # Requests. The sheets stay after archiving is turned off, so they
+            # are looked up whenever the month's sheet exists.
+            row = await self.archiver.find(request_id)
+            if row is not None:
+                return None, row
+        if entry is None and not self.breaker.is_open():
+            # The request may have been added by another process or by hand
+            await self.requests.refresh()
+            self._reapply_pending_statuses()
+            entry = self.requests.get(request_id)
+        return entry
+
+    def _reapply_pending_statuses(self):
+        for op in self.writes.pending():
+            if op['kind'] == 'status' and self.requests.get(op['request_id']):
+                self.requests.set_status(op['request_id'], op['status'], op['accepted_by'], op.get('changed_at'))
+
+    # Changes made by other shard workers, which also write them to the sheet
+    def _apply_user_event(self, event):
+        self.users.add(event['row'])
+
+    def _apply_request_event(self, event):
+        if not self.requests.get(event['row'][0]):
+            self.requests.add(None, event['row'])
+
+    def _apply_requests_saved_event(self, event):
+        for request_id, row_number in event['rows']:
+            entry = self.requests.get(request_id)
+            if entry and entry[0] is None:
+                self.requests.set_row_number(request_id, row_number)
+
+    def _apply_status_event(self, event):
+        if self.requests.get(event['request_id']):
+            self.requests.set_status(event['request_id'], event['status'], event['accepted_by'], event['changed_at'])
+
+    def _restore_write(self, op):
+        if op['kind'] == 'user':
+            if self.users.contains(op['row'][4]):
+                return False
+            self.users.add(op['row'], saved=False)
+        elif op['kind'] == 'request':
+            if self.requests.get(op['row'][0]):
+                return False
+            self.requests.add(None, op['row'])
+        elif op['kind'] == 'status':
+            if not self.requests.get(op['request_id']):
+                return False
+            self.requests.set_status(op['request_id'], op['status'], op['accepted_by'], op.get('changed_at'))
+        return True
+
+    async def _append_rows(self, range_name, rows):
+        result = await self._execute(self.service.spreadsheets().values().append(
+            spreadsheetId=SPREADSHEET_ID,
+            range=range_name,
+            valueInputOption='RAW',
+            body={'values': rows}
+        ), write=True)
+        updated_range = result.get('updates', {}).get('updatedRange', '')
+        match = re.search(r'![A-Z]+(\d+)', updated_range)
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def _append_key(op):
+        return (op['kind'], (op['row'][4] if op['kind'] == 'user' else op['row'][0]).strip())
+
+    async def _drop_appended(self, kind, ops):
+        # Once no timed-out call is still running, the tail of the sheet shows
+        # which rows of a failed append made it; those are dropped like in
+        # _restore_write after a restart, the rest is returned to be retried
+        if self._abandoned:
+            await asyncio.wait(set(self._abandoned), timeout=SHEETS_TIMEOUT)
+            if self._abandoned:
+                raise TimeoutError("An earlier Google Sheets call is still running")
+        if kind == 'user':
+            await self.users.all()
+            first_row = self.users.row_count + 1
+            rows = (await self._execute(self.service.spreadsheets().values().get(
+                spreadsheetId=SPREADSHEET_ID,
+                range=f"Users!A{first_row}:G"
+            ))).get('values', [])
+            self.users.add_rows(first_row, rows)
+            written = {str(row[4]).strip() for row in rows if len(row) > 4}
+            for telegram_id in written:
+                self.users.mark_saved(telegram_id)
+        else:
+            await self.requests.ensure_loaded()
+            first_row = self.requests.last_row() + 1
+            rows = (await self._execute(self.service.spreadsheets().values().get(
+                spreadsheetId=SPREADSHEET_ID,
+                range=f"Requests!A{first_row}:L"
+            ))).get('values', [])
+            written = {}
+            for offset, row in enumerate(rows):
+                if row:
+                    written[str(row[0]).strip()] = first_row + offset
+            saved = []
+            for op in ops:
+                request_id = op['row'][0].strip()
+                entry = self.requests.get(request_id)
+                if request_id in written and entry and entry[0] is None:
+                    self.requests.set_row_number(request_id, written[request_id])
+                    saved.append([request_id, written[request_id]])
+            if saved:
+                events.publish('requests_saved', rows=saved)
+        self._unconfirmed.difference_update(self._append_key(op) for op in ops)
+        kept = [op for op in ops if self._append_key(op)[1] not in written]
+        if len(kept) < len(ops):
+            logging.warning(f"{len(ops) - len(kept)} {kind} rows were saved by an append that failed")
+        return kept
+
+    async def _check_appended(self, kind, ops):
+        try:
+            return await self._drop_appended(kind, ops)
+        except SHEETS_ERRORS as error:
+            logging.error(f"Could not check which {kind}s were saved, will check again: {error}")
+            return ops
+
+    async def _append_ops(self, kind, ops, save):
+        # Returns the operations to retry
+        if any(self._append_key(op) in self._unconfirmed for op in ops):
+            ops = await self._check_appended(kind, ops)
+            if not ops or any(self._append_key(op) in self._unconfirmed for op in ops):
+                return ops
+        try:
+            await save(ops)
+            return []
+        except SHEETS_ERRORS as error:
+            logging.error(f"An error occurred while saving {kind}s: {error}")
+            if not isinstance(error, OSError):
+                # Rejected by Sheets or never sent
+                return ops
+        # No reply, the rows may have been appended anyway
+        self._unconfirmed.update(self._append_key(op) for op in ops)
+        return await self._check_appended(kind, ops)
+
+    async def _unregistered(self, user_ops):
+        # Users who registered again, e.g. while the directory could not be
+        # read, keep the row they already have in the sheet
+        await self.users.all()
+        kept = []
+        seen = set()
+        for op in user_ops:
+            telegram_id = op['row'][4].strip()
+            if self.users.in_sheet(telegram_id) or telegram_id in seen:
+                logging.info(f"User {telegram_id} is already registered, not saving again")
+                self.users.mark_saved(telegram_id)
+            else:
+                seen.add(telegram_id)
+                kept.append(op)
+        return kept
+
+    async def _save_users(self, user_ops):
+        first_row = await self._append_rows(USERS_RANGE, [op['row'] for op in user_ops])
+        if first_row is not None:
+            self.users.note_rows(first_row + len(user_ops) - 1)
+        for op in user_ops:
+            self.users.mark_saved(op['row'][4])
+
+    async def _save_requests(self, request_ops):
+        first_row = await self._append_rows(REQUESTS_RANGE, [op['row'] for op in request_ops])
+        for offset, op in enumerate(request_ops):
+            if first_row is None:
+                # Row numbers unknown, the next index refresh will pick them up
+                self.requests.set_row_number(op['row'][0], None)
+            else:
+                self.requests.set_row_number(op['row'][0], first_row + offset)
+        if first_row is not None:
+            events.publish('requests_saved', rows=[
+                [op['row'][0], first_row + offset] for offset, op in enumerate(request_ops)])
+        logging.debug(f"Saved {len(request_ops)} requests")
+
+    async def _flush_writes(self, ops):
+        if self.breaker.is_open():
+            # Keep the writes queued until Sheets recovers
+            return ops
+        retry = []
+
+        user_ops = [op for op in ops if op['kind'] == 'user']
+        if user_ops:
+            try:
+                user_ops = await self._unregistered(user_ops)
+            except SHEETS_ERRORS as error:
+                logging.error(f"An error occurred while loading users: {error}")
+                retry.extend(user_ops)
+                user_ops = []
+        if user_ops:
+            retry.extend(await self._append_ops('user', user_ops, self._save_users))
+
+        request_ops = [op for op in ops if op['kind'] == 'request']
+        if request_ops:
+            retry.extend(await self._append_ops('request', request_ops, self._save_requests))
+
+        # Only the latest status of each request needs to be written
+        status_ops = {}
+        for op in ops:
+            if op['kind'] != 'status':
+                continue
+            entry = self.requests.get(op['request_id'])
+            if entry is None:
+                logging.error(f"Request not found for status update: {op['request_id']}")
+            elif entry[0] is None:
+                retry.append(op)
+            else:
+                status_ops[op['request_id']] = (entry[0], op)
+        if status_ops:
+            data = []
+            for row_number, op in status_ops.values():
+                # Accepted At and Solved At come from the cached row, which has all earlier changes
+                row = self.requests.get(op['request_id'])[1]
+                timestamps = (row + [""] * (12 - len(row)))[10:12]
+                data.append({'range': f'Requests!I{row_number}:L{row_number}',
+                             'values': [[op['status'], op['accepted_by']] + timestamps]})
+            try:
+                await self._execute(self.service.spreadsheets().values().batchUpdate(
+                    spreadsheetId=SPREADSHEET_ID,
+                    body={'valueInputOption': 'RAW', 'data': data}
+                ), write=True)
+                logging.debug(f"Updated status of {len(data)} requests")
+            except SHEETS_ERRORS as error:
+                logging.error(f"An error occurred while updating request statuses: {error}")
+                retry.extend(op for _, op in status_ops.values())
+
+        # Keep the original order so writes for one request stay sequential
+        retry_ids = {id(op) for op in retry}
+        return [op for op in ops if id(op) in retry_ids]
+
+    async def get_user_data(self, telegram_id):
+        try:
+            return await self.users.get(telegram_id)
+        except SHEETS_ERRORS as error:
             logging.error(f"An error occurred while getting user data: {error}")
+            return UNAVAILABLE
+
+    async def get_users(self, floor=None, department=None):
+        try:
+            users = await self.users.all()
+        except SHEETS_ERRORS as error:
+            logging.error(f"An error occurred while getting users: {error}")
             return None
+        return [
+            user for user in users
+            if (floor is None or str(user['floor']).strip() == str(floor))
+            and (department is None or user['department'].strip().lower() == department.lower())
+        ]
 
     async def get_request_data(self, request_id):
         try:
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=SPREADSHEET_ID,
-                range=REQUESTS_RANGE
-            ).execute()
-            values = result.get('values', [])
-            
-            logging.info(f"Searching for request ID: {request_id}")
-            logging.info(f"Total requests found: {len(values)}")
-            
-            # Skip header row
-            for row in values[1:]:
-                current_id = str(row[0]).strip()
-                search_id = str(request_id).strip()
-                logging.info(f"Comparing current_id: '{current_id}' with search_id: '{search_id}'")
-                
-                if current_id == search_id:
-                    logging.info(f"Found matching request: {current_id}")
-                    return {
-                        'request_id': row[0],
-                        'user_id': row[1],
-                        'name': row[2],
-                        'department': row[3],
-                        'floor': row[4],
-                        'topic': row[5],
-                        'description': row[6],
-                        'date': row[7],
-                        'status': row[8] if len(row) > 8 else "Pending",
-                        'accepted_by': row[9] if len(row) > 9 else ""
-                    }
-            
-            logging.error(f"Request not found: {request_id}")
-            return None
-        except HttpError as error:
+            entry = await self._find_request(request_id, archived=True)
+            if entry is None:
+                logging.error(f"Request not found: {request_id}")
+                return None
+            return row_to_request(entry[1])
+        except SHEETS_ERRORS as error:
             logging.error(f"An error occurred while getting request data: {error}")
             return None
 
     async def save_user(self, user_data):
+        row = [
+            user_data['name'],
+            user_data['phone'],
+            user_data['department'],
+            user_data['floor'],
+            user_data['telegram_id'],
+            user_data['username'],
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        ]
+        row = [str(value) if value is not None else "" for value in row]
         try:
-            values = [[
-                user_data['name'],
-                user_data['phone'],
-                user_data['department'],
-                user_data['floor'],
-                user_data['telegram_id'],
-                user_data['username'],
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            ]]
-            body = {'values': values}
-            self.service.spreadsheets().values().append(
-                spreadsheetId=SPREADSHEET_ID,
-                range=USERS_RANGE,
-                valueInputOption='RAW',
-                body=body
-            ).execute()
-            return True
-        except HttpError as error:
+            self.writes.enqueue({'kind': 'user', 'row': row})
+        except OSError as error:
             logging.error(f"An error occurred while saving user: {error}")
             return False
+        self.users.add(row, saved=False)
+        events.publish('user', row=row)
+        return True
 
     async def save_request(self, request_data):
+        row = [
+            request_data['request_id'],
+            request_data['user_id'],
+            request_data['name'],
+            request_data['department'],
+            request_data['floor'],
+            request_data['topic'],
+            request_data['description'],
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "Pending",
+            "",  # Accepted by
+            "",  # Accepted at
+            ""  # Solved at
+        ]
+        row = [str(value) for value in row]
         try:
-            values = [[
-                request_data['request_id'],
-                request_data['user_id'],
-                request_data['name'],
-                request_data['department'],
-                request_data['floor'],
-                request_data['topic'],
-                request_data['description'],
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "Pending",
-                ""  # Accepted by
-            ]]
-            body = {'values': values}
-            self.service.spreadsheets().values().append(
-                spreadsheetId=SPREADSHEET_ID,
-                range=REQUESTS_RANGE,
-                valueInputOption='RAW',
-                body=body
-            ).execute()
-            logging.info(f"Request saved successfully: {request_data['request_id']}")
-            return True
-        except HttpError as error:
+            self.writes.enqueue({'kind': 'request', 'row': row})
+        except OSError as error:
             logging.error(f"An error occurred while saving request: {error}")
             return False
+        self.requests.add(None, row)
+        events.publish('request', row=row)
+        logging.debug(f"Request queued for saving: {request_data['request_id']}")
+        return True
+
+    def _has_pending_status(self, request_id):
+        return any(op['kind'] == 'status' and op['request_id'] == request_id for op in self.writes.pending())
 
-    async def update_request_status(self, request_id, status, accepted_by=None):
+    async def _refresh_status(self, request_id, row_number):
+        # Another process may have changed the row since it was cached
+        result = await self._execute(self.service.spreadsheets().values().get(
+            spreadsheetId=SPREADSHEET_ID,
+            range=f'Requests!I{row_number}:J{row_number}'
+        ))
+        values = (result.get('values') or [[]])[0]
+        status = values[0] if len(values) > 0 and values[0] else "Pending"
+        accepted_by = values[1] if len(values) > 1 else ""
+        self.requests.set_status(request_id, status, accepted_by)
+
+    async def update_request_status(self, request_id, status, accepted_by=None, expected_status=None):
+        request_id = str(request_id).strip()
         try:
-            # Find the row with the request_id
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=SPREADSHEET_ID,
-                range=REQUESTS_RANGE
-            ).execute()
-            values = result.get('values', [])
-            
-            logging.info(f"Updating status for request ID: {request_id}")
-            logging.info(f"Total requests found: {len(values)}")
-            
-            # Skip header row and start from row 2
-            for i, row in enumerate(values[1:], start=2):
-                current_id = str(row[0]).strip()
-                search_id = str(request_id).strip()
-                logging.info(f"Comparing current_id: '{current_id}' with search_id: '{search_id}'")
-                
-                if current_id == search_id:
-                    logging.info(f"Found matching request for update: {current_id}")
-                    # Update status and accepted_by
-                    body = {'values': [[status, accepted_by if accepted_by else row[9] if len(row) > 9 else ""]]}
-                    self.service.spreadsheets().values().update(
-                        spreadsheetId=SPREADSHEET_ID,
-                        range=f'Requests!I{i}:J{i}',
-                        valueInputOption='RAW',
-                        body=body
-                    ).execute()
-                    logging.info(f"Request status updated successfully: {request_id}")
-                    return True
-            
-            logging.error(f"Request not found for status update: {request_id}")
+            entry = await self._find_request(request_id)
+            if entry is None:
+                logging.error(f"Request not found for status update: {request_id}")
+                return False
+            if expected_status is not None:
+                row_number = entry[0]
+                # Not atomic, see CHECK_SHEET_BEFORE_UPDATE. Our own queued or
+                # in-flight status is newer than the sheet, so it is not re-read then.
+                if CHECK_SHEET_BEFORE_UPDATE and row_number is not None and not self._has_pending_status(request_id):
+                    await self._refresh_status(request_id, row_number)
+                    entry = self.requests.get(request_id)
+                current_status = row_to_request(entry[1])['status']
+                if current_status != expected_status:
+                    logging.info(f"Request {request_id} is {current_status}, not {expected_status}")
+                    return False
+        except SHEETS_ERRORS as error:
+            logging.error(f"An error occurred while updating request status: {error}")
             return False
-        except HttpError as error:
+
+        _, row = entry
+        accepted_by = accepted_by if accepted_by else row[9] if len(row) > 9 else ""
+        changed_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            self.writes.enqueue({'kind': 'status', 'request_id': request_id,
+                                 'status': status, 'accepted_by': accepted_by, 'changed_at': changed_at})
+        except OSError as error:
             logging.error(f"An error occurred while updating request status: {error}")
             return False
+        self.requests.set_status(request_id, status, accepted_by, changed_at)
+        events.publish('status', request_id=request_id, status=status, accepted_by=accepted_by, changed_at=changed_at)
+        logging.debug(f"Request status update queued: {request_id}")
+        return True
+
+    async def request_stats(self):
+        try:
+            await self.requests.ensure_loaded()
+        except SHEETS_ERRORS as error:
+            logging.error(f"An error occurred while loading request stats: {error}")
+            return None
+        return self.aggregates.snapshot()
+
+def create_database():
+    if STORAGE_BACKEND == 'sqlite':
+        from sqlite_storage import SQLiteDatabase
+        sheets = Database() if SQLITE_MIRROR_TO_SHEETS or SQLITE_IMPORT_FROM_SHEETS else None
+        return instrument_storage(SQLiteDatabase(
+            SQLITE_PATH,
+            mirror=sheets if SQLITE_MIRROR_TO_SHEETS else None,
+            source=sheets if SQLITE_IMPORT_FROM_SHEETS else None
+        ))
+    return instrument_storage(Database())
 
 # Create a singleton instance
-db = Database() 
\ No newline at end of file
+db = create_database() 
\ No newline at end of file
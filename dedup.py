@@ -0,0 +1,77 @@
+import re
+import time
+from collections import OrderedDict
+
+WORD_PATTERN = re.compile(r"[^\W_]+")
+APOSTROPHES = str.maketrans({"ʻ": "'", "ʼ": "'", "‘": "'", "’": "'", "`": "'"})
+
+
+def normalize_text(text):
+    # Case, punctuation and word order do not matter:
+    # "Internet ishlamayapti!!" and "ishlamayapti internet" match
+    words = WORD_PATTERN.findall((text or "").translate(APOSTROPHES).replace("'", "").lower())
+    return ' '.join(sorted(set(words)))
+
+
+# Recently created requests by fingerprint: the same user, or anyone on the
+# same floor, reporting the same topic with the same description within
+# `ttl` seconds. Entries are kept in creation order, so expired ones and the
+# oldest ones beyond `max_size` are dropped from the front.
+# Users whose report was linked to an existing request are kept as watchers of
+# that request, in memory only.
+class DuplicateCache:
+    def __init__(self, ttl, max_size):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._watchers = {}
+
+    @staticmethod
+    def _keys(user_id, floor, topic, description):
+        text = normalize_text(description)
+        if not text:
+            return []
+        return [('user', str(user_id), topic, text), ('floor', str(floor), topic, text)]
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._entries:
+            key, (request_id, created_at) = next(iter(self._entries.items()))
+            if now - created_at <= self._ttl and len(self._entries) <= self._max_size:
+                break
+            self._entries.popitem(last=False)
+
+    def find(self, user_id, floor, topic, description):
+        # Returns (request_id, scope) of a matching request or (None, None)
+        if self._ttl <= 0:
+            return None, None
+        self._expire()
+        for key in self._keys(user_id, floor, topic, description):
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry[0], key[0]
+        return None, None
+
+    def add(self, request_id, user_id, floor, topic, description):
+        if self._ttl <= 0:
+            return
+        now = time.monotonic()
+        for key in self._keys(user_id, floor, topic, description):
+            self._entries[key] = (request_id, now)
+            self._entries.move_to_end(key)
+        self._expire()
+
+    def watch(self, request_id, user_id):
+        self._watchers.setdefault(request_id, set()).add(int(user_id))
+
+    def watchers(self, request_id):
+        return sorted(self._watchers.get(request_id, ()))
+
+    def forget(self, request_id):
+        # The request is solved, new reports should create a new request
+        self._watchers.pop(request_id, None)
+        for key in [key for key, (entry_id, _) in self._entries.items() if entry_id == request_id]:
+            del self._entries[key]
+
+    def stats(self):
+        return {'size': len(self._entries), 'watched_requests': len(self._watchers)}
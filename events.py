@@ -0,0 +1,28 @@
+# Change notifications between bot processes in sharded mode (see shards.py).
+# Storage and handlers publish the changes they make to their in-memory state;
+# a shard worker sends every event to the other workers, which pass it to the
+# handlers registered with on(). In a single process nobody listens and
+# publish() does nothing.
+_handlers = {}
+_listeners = []
+
+
+def on(kind, handler):
+    _handlers.setdefault(kind, []).append(handler)
+
+
+def listen(listener):
+    _listeners.append(listener)
+
+
+def publish(kind, **data):
+    if not _listeners:
+        return
+    event = dict(data, kind=kind)
+    for listener in _listeners:
+        listener(event)
+
+
+def apply(event):
+    for handler in _handlers.get(event['kind'], ()):
+        handler(event)
@@ -0,0 +1,330 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+import httplib2
+from googleapiclient.errors import HttpError
+import aiohttp
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, InlineKeyboardMarkup, Message
+
+USERS_HEADER = ['Name', 'Phone', 'Department', 'Floor', 'Telegram ID', 'Username', 'Registration Date']
+REQUESTS_HEADER = ['Request ID', 'User ID', 'Name', 'Department', 'Floor', 'Topic', 'Description', 'Date',
+                   'Status', 'Accepted By', 'Accepted At', 'Solved At']
+
+RANGE_PATTERN = re.compile(r'^([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?$')
+
+
+def column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - 64
+    return number
+
+
+def parse_range(range_name):
+    sheet, _, cells = range_name.partition('!')
+    first_column, first_row, last_column, last_row = RANGE_PATTERN.match(cells).groups()
+    return (
+        sheet,
+        column_number(first_column) - 1,
+        int(first_row) if first_row else 1,
+        column_number(last_column or first_column),
+        int(last_row) if last_row else None
+    )
+
+
+class FakeRequest:
+    def __init__(self, service, name, handler):
+        self._service = service
+        self._name = name
+        self._handler = handler
+        self.methodId = f"sheets.spreadsheets.{name}"
+
+    def execute(self, http=None, num_retries=0):
+        service = self._service
+        latency = service.call_latency.get(self._name, service.latency)
+        if latency:
+            time.sleep(latency)
+        with service.lock:
+            service.calls[self._name] += 1
+            if service.rejections[self._name]:
+                service.rejections[self._name] -= 1
+                raise HttpError(httplib2.Response({'status': 400}), b'Invalid request')
+            if service.error_rate and random.random() < service.error_rate:
+                raise HttpError(httplib2.Response({'status': 429}), b'Quota exceeded')
+            return self._handler()
+
+
+class FakeValues:
+    def __init__(self, service):
+        self._service = service
+
+    def _read(self, range_name):
+        sheet, first_column, first_row, last_column, last_row = parse_range(range_name)
+        rows = self._service.sheets.setdefault(sheet, [])
+        values = []
+        for row in rows[first_row - 1:last_row]:
+            row = row[first_column:last_column]
+            # Like the real API, trailing empty cells and rows are omitted
+            while row and row[-1] == '':
+                row = row[:-1]
+            values.append(row)
+        while values and not values[-1]:
+            values.pop()
+        result = {'range': range_name, 'majorDimension': 'ROWS'}
+        if values:
+            result['values'] = values
+        return result
+
+    def _write(self, range_name, values):
+        sheet, first_column, first_row, _, _ = parse_range(range_name)
+        rows = self._service.sheets.setdefault(sheet, [])
+        for offset, new_values in enumerate(values):
+            index = first_row - 1 + offset
+            while len(rows) <= index:
+                rows.append([])
+            row = rows[index]
+            end = first_column + len(new_values)
+            row.extend([''] * (end - len(row)))
+            row[first_column:end] = [str(value) for value in new_values]
+        return len(values)
+
+    def get(self, spreadsheetId, range, **kwargs):
+        return FakeRequest(self._service, 'values.get', lambda: self._read(range))
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        return FakeRequest(self._service, 'values.batchGet', lambda: {
+            'spreadsheetId': spreadsheetId,
+            'valueRanges': [self._read(range_name) for range_name in ranges]
+        })
+
+    def append(self, spreadsheetId, range, valueInputOption, body, **kwargs):
+        def handler():
+            sheet = range.partition('!')[0]
+            rows = self._service.sheets.setdefault(sheet, [])
+            first_row = len(rows) + 1
+            rows.extend([str(value) for value in row] for row in body['values'])
+            return {'updates': {
+                'updatedRange': f"{sheet}!A{first_row}:L{len(rows)}",
+                'updatedRows': len(body['values'])
+            }}
+        return FakeRequest(self._service, 'values.append', handler)
+
+    def update(self, spreadsheetId, range, valueInputOption, body, **kwargs):
+        return FakeRequest(self._service, 'values.update', lambda: {
+            'updatedRange': range,
+            'updatedRows': self._write(range, body['values'])
+        })
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        def handler():
+            for data in body['data']:
+                self._write(data['range'], data['values'])
+            return {'totalUpdatedRows': sum(len(data['values']) for data in body['data'])}
+        return FakeRequest(self._service, 'values.batchUpdate', handler)
+
+
+class FakeSpreadsheets:
+    def __init__(self, service):
+        self._service = service
+
+    def values(self):
+        return FakeValues(self._service)
+
+    def get(self, spreadsheetId, **kwargs):
+        return FakeRequest(self._service, 'get', lambda: {'sheets': [
+            {'properties': {'sheetId': sheet_id, 'title': title}}
+            for title, sheet_id in self._service.sheet_ids.items()
+        ]})
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        # Supports the requests used by the archiver: addSheet, appendCells, deleteDimension
+        def handler():
+            service = self._service
+            titles = {sheet_id: title for title, sheet_id in service.sheet_ids.items()}
+            for request in body['requests']:
+                if 'addSheet' in request:
+                    properties = request['addSheet']['properties']
+                    if properties['title'] in service.sheet_ids:
+                        raise HttpError(httplib2.Response({'status': 400}), b'Sheet already exists')
+                    service.sheet_ids[properties['title']] = properties['sheetId']
+                    titles[properties['sheetId']] = properties['title']
+                    service.sheets[properties['title']] = []
+                elif 'appendCells' in request:
+                    rows = service.sheets[titles[request['appendCells']['sheetId']]]
+                    for row in request['appendCells']['rows']:
+                        rows.append([cell['userEnteredValue']['stringValue'] for cell in row['values']])
+                elif 'deleteDimension' in request:
+                    cells = request['deleteDimension']['range']
+                    del service.sheets[titles[cells['sheetId']]][cells['startIndex']:cells['endIndex']]
+            return {'spreadsheetId': spreadsheetId, 'replies': [{} for _ in body['requests']]}
+        return FakeRequest(self._service, 'batchUpdate', handler)
+
+
+# In-process stand-in for the Sheets v4 service object returned by
+# googleapiclient's build(). Every call sleeps `latency` seconds (or
+# `call_latency[name]`) in the calling thread, then takes effect, and is counted
+# in `calls`. The next `rejections[name]` calls of a method fail with a 400.
+class FakeSheetsService:
+    def __init__(self, latency=0.0, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.call_latency = {}
+        self.rejections = Counter()
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.sheets = {
+            'Users': [list(USERS_HEADER)],
+            'Requests': [list(REQUESTS_HEADER)]
+        }
+        self.sheet_ids = {'Users': 0, 'Requests': 1}
+
+    def spreadsheets(self):
+        return FakeSpreadsheets(self)
+
+    def seed_users(self, count, first_id=1000):
+        for i in range(count):
+            self.sheets['Users'].append([
+                f"User {i}", f"+99890{i:07d}", f"Department {i % 12}", str(i % 4 + 1),
+                str(first_id + i), f"user{i}", datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            ])
+
+    def seed_requests(self, count, first_user_id=1000, users=1, now=None):
+        now = now or datetime.now()
+        for i in range(count):
+            user_id = first_user_id + i % max(users, 1)
+            self.sheets['Requests'].append([
+                f"{now.strftime('%Y%m%d%H%M%S')}_{900000000 + i}", str(user_id), f"User {i}", "Department",
+                "1", "Internet", "Seeded request", now.strftime("%Y-%m-%d %H:%M:%S"), "Solved", "staff",
+                (now + timedelta(minutes=5)).strftime("%Y-%m-%d %H:%M:%S"),
+                (now + timedelta(hours=1)).strftime("%Y-%m-%d %H:%M:%S")
+            ])
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+
+# aiogram session that answers Bot API methods locally instead of calling
+# Telegram. Sent messages get increasing message IDs; on_request(method, result)
+# is called for every successful call. Messages to chats in `blocked_chats` fail
+# like they do for users who blocked the bot.
+class FakeTelegramSession(BaseSession):
+    def __init__(self, latency=0.0, retry_after_rate=0.0):
+        super().__init__()
+        self.latency = latency
+        self.retry_after_rate = retry_after_rate
+        self.calls = Counter()
+        self.on_request = None
+        self.blocked_chats = set()
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.retry_after_rate and random.random() < self.retry_after_rate:
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=1)
+        result = True
+        if isinstance(method, SendMessage) and int(method.chat_id) in self.blocked_chats:
+            raise TelegramForbiddenError(method=method, message="Forbidden: bot was blocked by the user")
+        if isinstance(method, SendMessage):
+            self._message_id += 1
+            chat_id = int(method.chat_id)
+            result = Message(
+                message_id=self._message_id,
+                date=datetime.now(),
+                chat=Chat(id=chat_id, type='private' if chat_id > 0 else 'supergroup'),
+                text=method.text,
+                reply_markup=method.reply_markup if isinstance(method.reply_markup, InlineKeyboardMarkup) else None
+            ).as_(bot)
+        if self.on_request is not None:
+            self.on_request(method, result)
+        return result
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+
+# Posts updates to the bot's webhook the way Telegram does, with the secret
+# token header. Tracks the updates through the dispatcher, so post() can wait
+# until an update has been handled and `handled` counts finished updates.
+class FakeUpdatePoster:
+    def __init__(self, dispatcher, url, secret_token=None):
+        self.url = url
+        self.secret_token = secret_token
+        self.handled = 0
+        self._done = {}
+        self._session = None
+        dispatcher.update.outer_middleware(self._track)
+
+    async def _track(self, handler, update, data):
+        try:
+            return await handler(update, data)
+        finally:
+            self.handled += 1
+            future = self._done.pop(update.update_id, None)
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    async def post(self, update, wait=True):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        future = asyncio.get_running_loop().create_future()
+        self._done[update['update_id']] = future
+        headers = {'X-Telegram-Bot-Api-Secret-Token': self.secret_token} if self.secret_token else {}
+        async with self._session.post(self.url, json=update, headers=headers) as response:
+            response.raise_for_status()
+        if wait:
+            await future
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+# The part of the redis.asyncio client used by aiogram's RedisStorage, in
+# memory. Values are stored as bytes and expire after `ex` seconds like in Redis.
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.closed = False
+
+    def _alive(self, key):
+        value, expires_at = self.values.get(key, (None, None))
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self.values[key]
+            return None
+        return value
+
+    async def get(self, key):
+        return self._alive(key)
+
+    async def set(self, key, value, ex=None):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        self.values[key] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    async def delete(self, *keys):
+        return sum(self.values.pop(key, None) is not None for key in keys)
+
+    async def aclose(self, close_connection_pool=None):
+        self.closed = True
+
+
+def install_fake_sheets(service):
+    # Must run before `database` is imported: the Database singleton is created
+    # at import time and would otherwise load real credentials
+    import googleapiclient.discovery
+    from google.oauth2 import service_account
+    googleapiclient.discovery.build = lambda *args, **kwargs: service
+    service_account.Credentials.from_service_account_file = classmethod(lambda cls, *args, **kwargs: None)
@@ -0,0 +1,92 @@
+import json
+import logging
+import sqlite3
+import time
+from functools import partial
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from config import FSM_STORAGE, FSM_SQLITE_PATH, FSM_TTL, REDIS_URL
+
+# Compact JSON for stored conversation data
+dumps = partial(json.dumps, separators=(',', ':'), ensure_ascii=False)
+
+PURGE_EVERY = 100
+
+
+# FSM storage in a SQLite file, so half-finished conversations survive restarts
+# and can be shared by several processes on one machine. Records not touched for
+# `ttl` seconds are treated as abandoned and removed.
+class SQLiteFSMStorage(BaseStorage):
+    def __init__(self, path, ttl):
+        self.ttl = ttl
+        self.conn = sqlite3.connect(path, isolation_level=None, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}', expires_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS fsm_expires_at ON fsm (expires_at)")
+        self._writes = 0
+
+    @staticmethod
+    def _key(key):
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    def _get(self, key):
+        row = self.conn.execute(
+            "SELECT state, data FROM fsm WHERE key = ? AND expires_at > ?",
+            (self._key(key), time.time())
+        ).fetchone()
+        return row if row else (None, '{}')
+
+    def _put(self, key, state, data):
+        if state is None and data == '{}':
+            # Nothing to remember, keep the table small
+            self.conn.execute("DELETE FROM fsm WHERE key = ?", (self._key(key),))
+        else:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO fsm (key, state, data, expires_at) VALUES (?, ?, ?, ?)",
+                (self._key(key), state, data, time.time() + self.ttl)
+            )
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def purge_expired(self):
+        deleted = self.conn.execute("DELETE FROM fsm WHERE expires_at <= ?", (time.time(),)).rowcount
+        if deleted:
+            logging.info(f"Removed {deleted} expired conversation states")
+        return deleted
+
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        _, data = self._get(key)
+        self._put(key, state, data)
+
+    async def get_state(self, key):
+        return self._get(key)[0]
+
+    async def set_data(self, key, data):
+        state, _ = self._get(key)
+        self._put(key, state, dumps(data))
+
+    async def get_data(self, key):
+        return json.loads(self._get(key)[1])
+
+    async def close(self):
+        self.conn.close()
+
+
+def create_fsm_storage(redis=None):
+    # redis: an existing client (e.g. fakes.FakeRedis) used instead of connecting to REDIS_URL
+    if redis is None and FSM_STORAGE == 'memory':
+        return MemoryStorage()
+    if redis is not None or FSM_STORAGE == 'redis':
+        # Optional dependency, only needed for this backend
+        from aiogram.fsm.storage.redis import RedisStorage
+        if redis is not None:
+            return RedisStorage(redis, state_ttl=FSM_TTL, data_ttl=FSM_TTL, json_dumps=dumps)
+        return RedisStorage.from_url(REDIS_URL, state_ttl=FSM_TTL, data_ttl=FSM_TTL, json_dumps=dumps)
+    return SQLiteFSMStorage(FSM_SQLITE_PATH, FSM_TTL)
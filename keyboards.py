@@ -1,6 +1,48 @@
+import re
 from aiogram import types
+from aiogram.filters.callback_data import CallbackData
 from config import TOPICS
 
+REQUEST_ID_PATTERN = re.compile(r'^(\d{14})_(\d+)$')
+BASE36_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+def to_base36(number):
+    digits = ''
+    while True:
+        number, remainder = divmod(number, 36)
+        digits = BASE36_DIGITS[remainder] + digits
+        if number == 0:
+            return digits
+
+def encode_request_key(request_id):
+    # "20240115093012_123456789" -> "timestamp.user_id" in base 36, about 17 characters
+    match = REQUEST_ID_PATTERN.match(str(request_id))
+    if not match:
+        return str(request_id)
+    return f"{to_base36(int(match.group(1)))}.{to_base36(int(match.group(2)))}"
+
+def decode_request_key(key):
+    if '.' not in key:
+        return key
+    timestamp, user_id = key.split('.', 1)
+    return f"{int(timestamp, 36):014d}_{int(user_id, 36)}"
+
+class RequestCallback(CallbackData, prefix="rq"):
+    action: str
+    key: str
+
+    @property
+    def request_id(self):
+        return decode_request_key(self.key)
+
+def request_button(text, action, request_id):
+    callback_data = RequestCallback(action=action, key=encode_request_key(request_id)).pack()
+    return types.InlineKeyboardButton(text=text, callback_data=callback_data)
+
+def legacy_request_id(data):
+    # Buttons sent before RequestCallback carried the full ID as "<action>_<request_id>"
+    return data.split("_", 1)[1].strip()
+
 def create_topic_keyboard():
     keyboard = []
     for topic in TOPICS:
@@ -14,23 +56,19 @@ def create_floor_keyboard():
     return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 def create_request_keyboard(request_id):
-    # Ensure request_id is a string and use the full request ID
-    request_id = str(request_id)
     keyboard = [
         [
-            types.InlineKeyboardButton(text="Javob berish", callback_data=f"reply_{request_id}"),
-            types.InlineKeyboardButton(text="Qabul qilish", callback_data=f"accept_{request_id}")
+            request_button("Javob berish", "reply", request_id),
+            request_button("Qabul qilish", "accept", request_id)
         ]
     ]
     return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 def create_solved_keyboard(request_id):
-    # Ensure request_id is a string and use the full request ID
-    request_id = str(request_id)
     keyboard = [
         [
-            types.InlineKeyboardButton(text="Javob berish", callback_data=f"reply_{request_id}"),
-            types.InlineKeyboardButton(text="Hal qilindi", callback_data=f"solve_{request_id}")
+            request_button("Javob berish", "reply", request_id),
+            request_button("Hal qilindi", "solve", request_id)
         ]
     ]
     return types.InlineKeyboardMarkup(inline_keyboard=keyboard) 
\ No newline at end of file
@@ -0,0 +1,26 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+# One asyncio.Lock per key, created on demand and dropped once nobody holds
+# or waits for it, so memory does not grow with the number of keys seen.
+class KeyedLocks:
+    def __init__(self):
+        self._locks = {}
+
+    @asynccontextmanager
+    async def lock(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
@@ -0,0 +1,182 @@
+import functools
+import logging
+import time
+from aiohttp import web
+from aiogram import BaseMiddleware
+from storage import UNAVAILABLE
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, *label_values, value):
+        counts, total, count = self.values.get(label_values, ([0] * len(self.buckets), 0.0, 0))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self.values[label_values] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(self.values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.labels + ('le',), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.labels + ('le',), label_values + ('+Inf',))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {count}")
+        return lines
+
+
+# Metrics in the Prometheus text format. Gauges are read from callbacks
+# returning {label_value: number} when /metrics is scraped.
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.gauges = []
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, label, callback):
+        self.gauges.append((name, help_text, label, callback))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for name, help_text, label, callback in self.gauges:
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge"])
+            try:
+                for label_value, value in sorted(callback().items()):
+                    lines.append(f"{name}{_format_labels((label,), (label_value,))} {value}")
+            except Exception as e:
+                logging.error(f"Failed to collect {name}: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+handler_duration = registry.histogram(
+    'bot_handler_duration_seconds', "Time spent in update handlers", ('handler',))
+handler_errors = registry.counter(
+    'bot_handler_errors_total', "Update handlers that raised an exception", ('handler',))
+storage_duration = registry.histogram(
+    'bot_storage_call_duration_seconds', "Time spent in storage methods", ('method',))
+storage_errors = registry.counter(
+    'bot_storage_errors_total', "Storage methods that raised or reported failure", ('method',))
+sheets_duration = registry.histogram(
+    'bot_sheets_request_duration_seconds', "Google Sheets API round trips, including retries", ('operation',))
+sheets_rows = registry.counter(
+    'bot_sheets_rows_total', "Rows read from or written to Google Sheets", ('operation',))
+sheets_errors = registry.counter(
+    'bot_sheets_errors_total', "Failed Google Sheets API calls", ('operation',))
+duplicate_requests = registry.counter(
+    'bot_duplicate_requests_total', "New requests linked to an open duplicate", ('scope',))
+
+
+# Inner middleware timing every message and callback handler
+class HandlerTimingMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object else 'unknown'
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_duration.observe(name, value=time.perf_counter() - started)
+
+
+STORAGE_METHODS = ('get_user_data', 'get_request_data', 'save_user', 'save_request', 'update_request_status',
+                   'request_stats', 'get_users')
+
+
+def instrument_storage(storage):
+    # Wraps the storage interface methods of one instance with timing and error counting
+    for name in STORAGE_METHODS:
+        method = getattr(storage, name)
+
+        @functools.wraps(method)
+        async def wrapper(*args, _method=method, _name=name, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await _method(*args, **kwargs)
+            except Exception:
+                storage_errors.inc(_name)
+                raise
+            finally:
+                storage_duration.observe(_name, value=time.perf_counter() - started)
+            if result is False or result is UNAVAILABLE:
+                storage_errors.inc(_name)
+            return result
+
+        setattr(storage, name, wrapper)
+    return storage
+
+
+def count_rows(result):
+    if not isinstance(result, dict):
+        return 0
+    if 'valueRanges' in result:
+        return sum(len(value_range.get('values', [])) for value_range in result['valueRanges'])
+    if 'values' in result:
+        return len(result['values'])
+    if 'updates' in result:
+        return result['updates'].get('updatedRows', 0)
+    return result.get('updatedRows', result.get('totalUpdatedRows', 0))
+
+
+async def metrics_handler(request):
+    return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+
+async def start_metrics_server(host, port):
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Metrics available on http://{host}:{port}/metrics")
+    return runner
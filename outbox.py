@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+from ratelimit import TokenBucket
+
+MAX_NETWORK_RETRIES = 3
+
+
+def _normalize_chat_id(chat_id):
+    try:
+        return int(chat_id)
+    except (TypeError, ValueError):
+        return chat_id
+
+
+def _is_group(chat_id):
+    return not isinstance(chat_id, int) or chat_id < 0
+
+
+# Central queue for outgoing Telegram messages. Every chat has its own FIFO
+# worker limited to the per-chat rate, and all workers share the global limit.
+# Pending edits of the same message are merged into one call.
+# Messages still queued when the bot shuts down are saved to `spool_path` and
+# sent after the next start by restore().
+class Outbox:
+    def __init__(self, bot, messages_per_second, group_messages_per_minute, chat_messages_per_second,
+                 spool_path=None):
+        self.bot = bot
+        self._spool_path = spool_path
+        self._global = TokenBucket(messages_per_second * 60, messages_per_second)
+        self._group_rate = group_messages_per_minute
+        self._chat_rate = chat_messages_per_second * 60
+        self._queues = {}
+        self._workers = {}
+        self._buckets = {}
+        self._edits = {}
+        self._paused_until = 0.0
+        self.sent = 0
+        self.failed = 0
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if _is_group(chat_id):
+                bucket = TokenBucket(self._group_rate, 1)
+            else:
+                bucket = TokenBucket(self._chat_rate, 1)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _enqueue(self, chat_id, item):
+        self._queues.setdefault(chat_id, deque()).append(item)
+        worker = self._workers.get(chat_id)
+        if worker is None or worker.done():
+            self._workers[chat_id] = asyncio.create_task(self._run(chat_id))
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        chat_id = _normalize_chat_id(chat_id)
+        self._enqueue(chat_id, {'method': 'send', 'text': text, 'reply_markup': reply_markup})
+
+    def _enqueue_edit(self, chat_id, item):
+        chat_id = _normalize_chat_id(chat_id)
+        key = (chat_id, item['message_id'], item['method'])
+        pending = self._edits.get(key)
+        if pending is not None:
+            # Only the latest markup or text matters
+            pending.update(item)
+            return
+        self._edits[key] = item
+        self._enqueue(chat_id, item)
+
+    async def edit_reply_markup(self, chat_id, message_id, reply_markup=None):
+        self._enqueue_edit(chat_id, {'method': 'edit', 'message_id': message_id, 'reply_markup': reply_markup})
+
+    async def edit_text(self, chat_id, message_id, text):
+        self._enqueue_edit(chat_id, {'method': 'edit_text', 'message_id': message_id, 'text': text})
+
+    async def reserve(self):
+        # Takes a slot from the global limit for a message sent outside the outbox
+        await self._global.acquire()
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def _deliver(self, chat_id, item):
+        if item['method'] == 'send':
+            await self.bot.send_message(chat_id=chat_id, text=item['text'], reply_markup=item['reply_markup'])
+        elif item['method'] == 'edit_text':
+            self._edits.pop((chat_id, item['message_id'], item['method']), None)
+            await self.bot.edit_message_text(text=item['text'], chat_id=chat_id, message_id=item['message_id'])
+        else:
+            self._edits.pop((chat_id, item['message_id'], item['method']), None)
+            await self.bot.edit_message_reply_markup(
+                chat_id=chat_id, message_id=item['message_id'], reply_markup=item['reply_markup'])
+
+    async def _run(self, chat_id):
+        queue = self._queues[chat_id]
+        bucket = self._bucket(chat_id)
+        while queue:
+            item = queue[0]
+            network_errors = 0
+            while True:
+                await bucket.acquire()
+                await self._global.acquire()
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                try:
+                    await self._deliver(chat_id, item)
+                    self.sent += 1
+                    break
+                except TelegramRetryAfter as e:
+                    logging.warning(f"Flood limit hit sending to {chat_id}, retrying after {e.retry_after}s")
+                    self.pause(e.retry_after)
+                except TelegramNetworkError as e:
+                    network_errors += 1
+                    if network_errors > MAX_NETWORK_RETRIES:
+                        logging.error(f"Failed to send message to {chat_id}: {e}")
+                        self.failed += 1
+                        break
+                    await asyncio.sleep(network_errors)
+                except TelegramAPIError as e:
+                    logging.error(f"Failed to send message to {chat_id}: {e}")
+                    self.failed += 1
+                    break
+            queue.popleft()
+        del self._queues[chat_id]
+        del self._workers[chat_id]
+        if not _is_group(chat_id):
+            self._buckets.pop(chat_id, None)
+
+    def stats(self):
+        return {
+            'queued': sum(len(queue) for queue in self._queues.values()),
+            'chats': len(self._queues),
+            'sent': self.sent,
+            'failed': self.failed
+        }
+
+    def _save(self):
+        # The first item of each queue may be in flight, it is sent again after the restart
+        items = [
+            dict(item, chat_id=chat_id, reply_markup=_dump_markup(item.get('reply_markup')))
+            for chat_id, queue in self._queues.items() for item in queue
+        ]
+        tmp_path = self._spool_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for item in items:
+                    f.write(json.dumps(item, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._spool_path)
+        except OSError as e:
+            logging.error(f"Failed to save {len(items)} undelivered messages: {e}")
+            return
+        logging.warning(f"Saved {len(items)} undelivered messages to {self._spool_path}")
+
+    def restore(self):
+        # Queues the messages saved on the last shutdown
+        if not self._spool_path or not os.path.exists(self._spool_path):
+            return
+        try:
+            with open(self._spool_path, encoding='utf-8') as f:
+                items = [json.loads(line) for line in f if line.strip()]
+            os.remove(self._spool_path)
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to read undelivered messages from {self._spool_path}: {e}")
+            return
+        for item in items:
+            chat_id = item.pop('chat_id')
+            item['reply_markup'] = _load_markup(item.get('reply_markup'))
+            if item['method'] == 'send':
+                self._enqueue(chat_id, item)
+            else:
+                self._enqueue_edit(chat_id, item)
+        if items:
+            logging.info(f"Restored {len(items)} undelivered messages")
+
+    async def close(self, timeout=10):
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        done, pending = await asyncio.wait(workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if not pending:
+            return
+        if self._spool_path:
+            self._save()
+        else:
+            logging.warning(f"Dropped messages for {len(pending)} chats on shutdown")
+
+
+def _dump_markup(markup):
+    return markup.model_dump(mode='json', exclude_none=True) if isinstance(markup, InlineKeyboardMarkup) else None
+
+
+def _load_markup(data):
+    return InlineKeyboardMarkup.model_validate(data) if data else None
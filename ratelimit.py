@@ -0,0 +1,97 @@
+import asyncio
+import random
+import time
+
+
+# Token bucket shared by all callers of one quota. Callers queue in order
+# and sleep until a token is available.
+class TokenBucket:
+    def __init__(self, rate_per_minute, capacity):
+        self._rate = rate_per_minute / 60
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waiting = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+    async def acquire(self):
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self._lock:
+                self._refill()
+                if self._tokens < 1:
+                    await asyncio.sleep((1 - self._tokens) / self._rate)
+                    self._refill()
+                self._tokens -= 1
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def stats(self):
+        return {
+            'queue_depth': self.waiting,
+            'acquired': self.acquired,
+            'avg_wait': self.total_wait / self.acquired if self.acquired else 0.0,
+            'max_wait': self.max_wait
+        }
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+# Opens after `threshold` consecutive failures and lets a single trial call
+# through once `reset_timeout` seconds have passed.
+class CircuitBreaker:
+    def __init__(self, threshold, reset_timeout):
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    def is_open(self):
+        return self._opened_at is not None and time.monotonic() - self._opened_at < self._reset_timeout
+
+    def remaining(self):
+        # Seconds until a trial call is let through, 0 when closed
+        if not self.is_open():
+            return 0.0
+        return self._reset_timeout - (time.monotonic() - self._opened_at)
+
+    def allow(self):
+        if self._opened_at is None:
+            return True
+        if self.is_open() or self._trial_running:
+            return False
+        self._trial_running = True
+        return True
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self._trial_running or self._failures >= self._threshold:
+            self._opened_at = time.monotonic()
+        self._trial_running = False
+
+
+def backoff_delay(attempt, base, cap):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * 2 ** attempt))
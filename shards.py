@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from ratelimit import backoff_delay
+
+# Nothing here may import config (or modules that do, like keyboards) at module
+# level: workers import this module before configure_shard() has set their
+# SHARDS and SHARD_INDEX, and config reads them only once, on import.
+
+# A worker that dies more than RESTART_LIMIT times in RESTART_WINDOW seconds
+# stops the supervisor instead of being restarted again
+RESTART_LIMIT = 5
+RESTART_WINDOW = 300
+
+SENDER_FIELDS = ('message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+                 'my_chat_member', 'chat_member', 'chat_join_request')
+
+
+def routing_key(update):
+    from keyboards import RequestCallback, legacy_request_id
+    callback = update.get('callback_query') or {}
+    data = callback.get('data') or ''
+    # Clicks on one request go to one worker, so the per-request lock still
+    # serializes them; everything else follows the sender and its FSM state
+    if data.startswith(('accept_', 'solve_')):
+        return legacy_request_id(data)
+    if data.startswith('rq:'):
+        try:
+            callback_data = RequestCallback.unpack(data)
+            if callback_data.action in ('accept', 'solve'):
+                return callback_data.request_id
+        except (TypeError, ValueError):
+            pass
+    for field in SENDER_FIELDS:
+        sender = (update.get(field) or {}).get('from')
+        if sender:
+            return sender['id']
+    return update.get('update_id', 0)
+
+
+def shard_for(update, shards):
+    # crc32 rather than hash(), which differs between processes for strings
+    return zlib.crc32(str(routing_key(update)).encode()) % shards
+
+
+async def _feed(app, update):
+    try:
+        await app.dp.feed_raw_update(app.bot, update)
+    except Exception as e:
+        logging.error(f"Error handling update {update.get('update_id')}: {e}")
+
+
+async def _run_worker(index, inbound):
+    import bot as app
+    import events
+    await app.db.warm_up()
+    app.outbox.restore()
+    app.broadcaster.resume()
+    metrics_runner = await app.start_metrics()
+    app.log_startup_time()
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    try:
+        while True:
+            item = await loop.run_in_executor(None, inbound.get)
+            if item is None:
+                break
+            kind, payload = item
+            if kind == 'update':
+                task = asyncio.create_task(_feed(app, payload))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            else:
+                events.apply(payload)
+        await asyncio.gather(*tasks)
+    finally:
+        await app.shutdown_services()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+    logging.info(f"Shard {index} stopped")
+
+
+def configure_shard(index, shards):
+    # Must run in the worker before anything imports config
+    if 'config' in sys.modules:
+        raise RuntimeError("config was imported before the shard was configured; "
+                           "the main module must not import it at module level")
+    os.environ['SHARDS'] = str(shards)
+    os.environ['SHARD_INDEX'] = str(index)
+    import config
+    return config
+
+
+def worker_main(index, shards, inbound, outbound, setup=None):
+    # Runs in a new process
+    config = configure_shard(index, shards)
+    # Ctrl+C reaches the whole process group, the supervisor decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=config.LOG_LEVEL, format=f"%(levelname)s:shard-{index}:%(name)s:%(message)s")
+    if setup is not None:
+        # e.g. installs fake APIs before the bot module is imported
+        setup()
+    import events
+    events.listen(lambda event: outbound.put((index, event)))
+    asyncio.run(_run_worker(index, inbound))
+
+
+# Starts the shard workers, routes updates to them and forwards the change
+# events each worker publishes to all the others. A worker that died is
+# restarted with a new queue, since a killed process can leave the old one
+# locked; the updates and events still waiting for it are lost.
+class Supervisor:
+    def __init__(self, shards, setup=None):
+        self._context = multiprocessing.get_context('spawn')
+        self._setup = setup
+        self.shards = shards
+        self._inbound = [self._context.Queue() for _ in range(shards)]
+        self._outbound = self._context.Queue()
+        self._processes = [self._new_process(index) for index in range(shards)]
+        self._restarts = [deque() for _ in range(shards)]
+        self._forwarder = threading.Thread(target=self._forward_events, name='shard-events', daemon=True)
+        self.routed = [0] * shards
+
+    def _new_process(self, index):
+        return self._context.Process(
+            target=worker_main, args=(index, self.shards, self._inbound[index], self._outbound, self._setup),
+            name=f"shard-{index}")
+
+    def start(self):
+        for process in self._processes:
+            process.start()
+        self._forwarder.start()
+        logging.info(f"Started {self.shards} shard workers")
+
+    def _forward_events(self):
+        while True:
+            item = self._outbound.get()
+            if item is None:
+                return
+            origin, event = item
+            for index, queue in enumerate(self._inbound):
+                if index != origin:
+                    queue.put(('event', event))
+
+    def _ensure_alive(self, index):
+        process = self._processes[index]
+        if process.is_alive():
+            return
+        now = time.monotonic()
+        restarts = self._restarts[index]
+        while restarts and now - restarts[0] > RESTART_WINDOW:
+            restarts.popleft()
+        if len(restarts) >= RESTART_LIMIT:
+            raise RuntimeError(f"{process.name} died {len(restarts) + 1} times in {RESTART_WINDOW}s "
+                               f"(exit code {process.exitcode}), stopping")
+        restarts.append(now)
+        logging.error(f"{process.name} died with exit code {process.exitcode}, restarting it; "
+                      f"updates routed to it and not handled yet are lost")
+        old_queue, self._inbound[index] = self._inbound[index], self._context.Queue()
+        # Nobody reads it any more, don't wait for its buffered items on exit
+        old_queue.cancel_join_thread()
+        old_queue.close()
+        self._processes[index] = self._new_process(index)
+        self._processes[index].start()
+
+    def check_workers(self):
+        for index in range(self.shards):
+            self._ensure_alive(index)
+
+    def route(self, update):
+        index = shard_for(update, self.shards)
+        self._ensure_alive(index)
+        self.routed[index] += 1
+        self._inbound[index].put(('update', update))
+
+    def stop(self, timeout=30):
+        # Workers finish the updates they already received and flush their writes
+        for queue in self._inbound:
+            queue.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logging.warning(f"{process.name} did not stop in {timeout}s, terminating")
+                process.terminate()
+        self._outbound.put(None)
+        self._forwarder.join()
+
+
+async def poll(supervisor, bot):
+    offset = None
+    attempt = 0
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30)
+            attempt = 0
+            # Also notices workers that died while no updates were routed to them
+            supervisor.check_workers()
+        except TelegramAPIError as e:
+            delay = backoff_delay(attempt, 1, 30)
+            logging.warning(f"Failed to get updates ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        for update in updates:
+            supervisor.route(update.model_dump(mode='json', exclude_none=True))
+            offset = update.update_id + 1
+
+
+async def main():
+    from config import BOT_TOKEN, SHARDS
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    supervisor = Supervisor(SHARDS)
+    supervisor.start()
+    bot = Bot(token=BOT_TOKEN)
+    try:
+        await poll(supervisor, bot)
+    finally:
+        await bot.session.close()
+        supervisor.stop()
+
+
+if __name__ == '__main__':
+    from config import LOG_LEVEL
+    logging.basicConfig(level=LOG_LEVEL)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
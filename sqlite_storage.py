@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import sqlite3
+from datetime import datetime
+from storage import Storage, UNAVAILABLE
+from dashboard import RequestStats
+import events
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    telegram_id TEXT PRIMARY KEY,
+    name TEXT,
+    phone TEXT,
+    department TEXT,
+    floor TEXT,
+    username TEXT,
+    registered_at TEXT
+);
+CREATE TABLE IF NOT EXISTS requests (
+    request_id TEXT PRIMARY KEY,
+    user_id TEXT,
+    name TEXT,
+    department TEXT,
+    floor TEXT,
+    topic TEXT,
+    description TEXT,
+    date TEXT,
+    status TEXT NOT NULL DEFAULT 'Pending',
+    accepted_by TEXT NOT NULL DEFAULT '',
+    accepted_at TEXT NOT NULL DEFAULT '',
+    solved_at TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS requests_user_id ON requests (user_id);
+"""
+
+REQUEST_COLUMNS = ("request_id, user_id, name, department, floor, topic, description, date, status, accepted_by, "
+                   "accepted_at, solved_at")
+
+
+# Local SQLite storage. Optionally mirrors every write to another backend
+# (the Google Sheets database) in the background, in the order they happened.
+# With a `source` (also the Google Sheets database), an empty database is
+# filled with its users and requests on warm-up.
+class SQLiteDatabase(Storage):
+    def __init__(self, path, mirror=None, source=None):
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        self.aggregates = RequestStats()
+        # The database file is shared by shard workers, only the counters are per process
+        events.on('request_stats', lambda event: self.aggregates.update(event['old'], event['new']))
+        self.mirror = mirror
+        self.source = source
+        self._mirror_queue = None
+        self._mirror_task = None
+
+    def _migrate(self):
+        # Databases created before the timestamp columns existed
+        columns = {row['name'] for row in self.conn.execute("PRAGMA table_info(requests)")}
+        for column in ('accepted_at', 'solved_at'):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE requests ADD COLUMN {column} TEXT NOT NULL DEFAULT ''")
+
+    def _is_empty(self):
+        return (self.conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None
+                and self.conn.execute("SELECT 1 FROM requests LIMIT 1").fetchone() is None)
+
+    async def import_from(self, source):
+        # One-time copy of rows as stored in Google Sheets (see Database.read_all)
+        users, requests = await source.read_all()
+        users = [row for row in users if len(row) > 4 and str(row[4]).strip()]
+        requests = [row + [""] * (12 - len(row)) for row in requests if len(row) > 7 and str(row[0]).strip()]
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(str(row[4]).strip(), row[0], row[1], row[2], row[3], row[5] if len(row) > 5 else "",
+                  row[6] if len(row) > 6 else "") for row in users]
+            )
+            self.conn.executemany(
+                f"INSERT OR IGNORE INTO requests ({REQUEST_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [[str(row[0]).strip()] + row[1:8] + [row[8] or "Pending"] + row[9:12] for row in requests]
+            )
+            self.conn.execute("COMMIT")
+        except sqlite3.Error:
+            self.conn.execute("ROLLBACK")
+            raise
+        logging.info(f"Imported {len(users)} users and {len(requests)} requests from Google Sheets")
+
+    async def warm_up(self):
+        if self.source is not None and self._is_empty():
+            try:
+                await self.import_from(self.source)
+            except Exception as e:
+                logging.error(f"Failed to import users and requests from Google Sheets: {e}")
+        self.aggregates.load(dict(row) for row in self.conn.execute(f"SELECT {REQUEST_COLUMNS} FROM requests"))
+        if self.mirror is not None:
+            await self.mirror.warm_up()
+
+    async def close(self):
+        if self._mirror_task is not None:
+            await self._mirror_queue.join()
+            self._mirror_task.cancel()
+        if self.mirror is not None:
+            await self.mirror.close()
+        elif self.source is not None:
+            await self.source.close()
+        self.conn.close()
+
+    def stats(self):
+        return {'mirror': self.mirror.stats()} if self.mirror is not None else {}
+
+    def _mirror_call(self, method, *args):
+        if self.mirror is None:
+            return
+        if self._mirror_task is None:
+            self._mirror_queue = asyncio.Queue()
+            self._mirror_task = asyncio.create_task(self._run_mirror())
+        self._mirror_queue.put_nowait((method, args))
+
+    async def _run_mirror(self):
+        while True:
+            method, args = await self._mirror_queue.get()
+            try:
+                if not await getattr(self.mirror, method)(*args):
+                    logging.error(f"Mirroring {method} to Google Sheets failed")
+            except Exception as e:
+                logging.error(f"Error mirroring {method} to Google Sheets: {e}")
+            finally:
+                self._mirror_queue.task_done()
+
+    async def get_user_data(self, telegram_id):
+        try:
+            row = self.conn.execute(
+                "SELECT name, phone, department, floor, telegram_id, username FROM users WHERE telegram_id = ?",
+                (str(telegram_id).strip(),)
+            ).fetchone()
+            return dict(row) if row else None
+        except sqlite3.Error as error:
+            logging.error(f"An error occurred while getting user data: {error}")
+            return UNAVAILABLE
+
+    async def get_users(self, floor=None, department=None):
+        try:
+            rows = self.conn.execute(
+                "SELECT name, phone, department, floor, telegram_id, username FROM users "
+                "WHERE (? IS NULL OR floor = ?) AND (? IS NULL OR lower(department) = lower(?))",
+                (floor, floor, department, department)
+            ).fetchall()
+            return [dict(row) for row in rows]
+        except sqlite3.Error as error:
+            logging.error(f"An error occurred while getting users: {error}")
+            return None
+
+    async def get_request_data(self, request_id):
+        try:
+            row = self.conn.execute(
+                f"SELECT {REQUEST_COLUMNS} FROM requests WHERE request_id = ?",
+                (str(request_id).strip(),)
+            ).fetchone()
+            if row is None:
+                logging.error(f"Request not found: {request_id}")
+                return None
+            return dict(row)
+        except sqlite3.Error as error:
+            logging.error(f"An error occurred while getting request data: {error}")
+            return None
+
+    async def save_user(self, user_data):
+        try:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(user_data['telegram_id']),
+                    user_data['name'],
+                    user_data['phone'],
+                    user_data['department'],
+                    str(user_data['floor']),
+                    user_data['username'] or "",
+                    datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                )
+            )
+        except sqlite3.Error as error:
+            logging.error(f"An error occurred while saving user: {error}")
+            return False
+        self._mirror_call('save_user', dict(user_data))
+        return True
+
+    async def save_request(self, request_data):
+        values = (
+            request_data['request_id'],
+            str(request_data['user_id']),
+            request_data['name'],
+            request_data['department'],
+            str(request_data['floor']),
+            request_data['topic'],
+            request_data['description'],
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "Pending", "", "", ""
+        )
+        try:
+            self.conn.execute(f"INSERT INTO requests ({REQUEST_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              values)
+        except sqlite3.Error as error:
+            logging.error(f"An error occurred while saving request: {error}")
+            return False
+        request = dict(zip(REQUEST_COLUMNS.split(', '), values))
+        self.aggregates.update(None, request)
+        events.publish('request_stats', old=None, new=request)
+        logging.info(f"Request saved successfully: {request_data['request_id']}")
+        self._mirror_call('save_request', dict(request_data))
+        return True
+
+    async def update_request_status(self, request_id, status, accepted_by=None, expected_status=None):
+        request_id = str(request_id).strip()
+        changed_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            previous = self.conn.execute(
+                f"SELECT {REQUEST_COLUMNS} FROM requests WHERE request_id = ?", (request_id,)).fetchone()
+            cursor = self.conn.execute(
+                "UPDATE requests SET status = ?, accepted_by = COALESCE(NULLIF(?, ''), accepted_by), "
+                "accepted_at = CASE WHEN ? = 'Accepted' THEN ? ELSE accepted_at END, "
+                "solved_at = CASE WHEN ? = 'Solved' THEN ? ELSE solved_at END "
+                "WHERE request_id = ? AND (? IS NULL OR status = ?)",
+                (status, accepted_by or "", status, changed_at, status, changed_at,
+                 request_id, expected_status, expected_status)
+            )
+        except sqlite3.Error as error:
+            logging.error(f"An error occurred while updating request status: {error}")
+            return False
+        if cursor.rowcount == 0:
+            if expected_status is not None and await self.get_request_data(request_id):
+                logging.info(f"Request {request_id} is no longer {expected_status}")
+            else:
+                logging.error(f"Request not found for status update: {request_id}")
+            return False
+        logging.info(f"Request status updated successfully: {request_id}")
+        previous = dict(previous) if previous else None
+        current = await self.get_request_data(request_id)
+        self.aggregates.update(previous, current)
+        events.publish('request_stats', old=previous, new=current)
+        self._mirror_call('update_request_status', request_id, status, accepted_by)
+        return True
+
+    async def request_stats(self):
+        return self.aggregates.snapshot()
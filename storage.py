@@ -0,0 +1,40 @@
+# Returned by get_user_data when users cannot be read right now. None means
+# the user is not registered.
+UNAVAILABLE = object()
+
+
+# Interface shared by the storage backends, bot.py only uses these methods
+class Storage:
+    async def warm_up(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def stats(self):
+        return {}
+
+    async def get_user_data(self, telegram_id):
+        raise NotImplementedError
+
+    async def get_request_data(self, request_id):
+        raise NotImplementedError
+
+    # Registered users, optionally only those on one floor or in one department
+    async def get_users(self, floor=None, department=None):
+        raise NotImplementedError
+
+    async def save_user(self, user_data):
+        raise NotImplementedError
+
+    async def save_request(self, request_data):
+        raise NotImplementedError
+
+    # With expected_status the update only happens if the request currently has
+    # that status, otherwise False is returned
+    async def update_request_status(self, request_id, status, accepted_by=None, expected_status=None):
+        raise NotImplementedError
+
+    # Counters for the staff dashboard, see dashboard.RequestStats.snapshot()
+    async def request_stats(self):
+        raise NotImplementedError
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+
+
+def fingerprint(request_id, status_cells):
+    # The API omits trailing empty cells and an empty status means Pending
+    if not request_id:
+        return None
+    status = status_cells[0] if len(status_cells) > 0 and status_cells[0] else "Pending"
+    accepted_by = status_cells[1] if len(status_cells) > 1 else ""
+    return [str(request_id).strip(), status, accepted_by]
+
+
+# Keeps the in-memory indexes in line with edits made directly in the
+# spreadsheet while reading as little as possible:
+# - with a Drive client, nothing is read unless the file's modifiedTime changed.
+#   Our own writes change it as well and cannot be told apart from edits made
+#   meanwhile by someone else, so while the bot is writing this skips nothing;
+# - rows appended elsewhere are read from the tail of each sheet only;
+# - request IDs and statuses (columns A and I:J) are read for the whole sheet
+#   and compared with the cache row by row, so this grows with the sheet (see
+#   ARCHIVE_AFTER_DAYS to keep it short); only blocks of `chunk_rows` rows with
+#   a difference are re-read in full (A:L).
+# Statuses changed by this process after the sync started, or still being
+# written, are newer than what was read and are kept.
+class IncrementalSync:
+    def __init__(self, database, spreadsheet_id, interval, chunk_rows, drive=None):
+        self.db = database
+        self.spreadsheet_id = spreadsheet_id
+        self.interval = interval
+        self.chunk_rows = chunk_rows
+        self.drive = drive
+        self._modified_time = None
+        self._task = None
+
+    async def _batch_get(self, ranges):
+        result = await self.db._execute(self.db.service.spreadsheets().values().batchGet(
+            spreadsheetId=self.spreadsheet_id,
+            ranges=ranges
+        ))
+        return [value_range.get('values', []) for value_range in result.get('valueRanges', [])]
+
+    async def _get(self, range_name):
+        result = await self.db._execute(self.db.service.spreadsheets().values().get(
+            spreadsheetId=self.spreadsheet_id,
+            range=range_name
+        ))
+        return result.get('values', [])
+
+    async def _spreadsheet_changed(self):
+        if self.drive is None:
+            return True
+        result = await self.db._execute(self.drive.files().get(
+            fileId=self.spreadsheet_id,
+            fields='modifiedTime'
+        ))
+        modified_time = result.get('modifiedTime')
+        if modified_time == self._modified_time:
+            return False
+        self._modified_time = modified_time
+        return True
+
+    async def sync_users(self):
+        if not self.db.users.row_count:
+            # Not loaded yet, the first lookup reads the whole sheet
+            return
+        first_row = self.db.users.row_count + 1
+        rows = await self._get(f"Users!A{first_row}:G")
+        if rows:
+            self.db.users.add_rows(first_row, rows)
+            logging.info(f"Synced {len(rows)} new users")
+
+    def _pending_statuses(self):
+        return {op['request_id'] for op in self.db.writes.pending() if op['kind'] == 'status'}
+
+    async def sync_requests(self):
+        index = self.db.requests
+        generation = index.generation
+        version = index.version
+
+        # New rows at the end of the sheet
+        last_row = index.last_row()
+        new_rows = await self._get(f"Requests!A{last_row + 1}:L")
+        if index.generation != generation:
+            # Rows were reloaded or archived meanwhile, try again next time
+            return
+        pending = self._pending_statuses()
+        for offset, row in enumerate(new_rows):
+            if row:
+                self._apply_row(last_row + 1 + offset, row, pending, version)
+        last_row += len(new_rows)
+
+        if last_row < 2:
+            return
+        # Request IDs and statuses only, so moved or deleted rows are noticed too
+        ids, statuses = await self._batch_get([f"Requests!A2:A{last_row}", f"Requests!I2:J{last_row}"])
+        if index.generation != generation:
+            return
+        cached = index.by_row()
+        changed = []
+        for start in range(2, last_row + 1, self.chunk_rows):
+            end = min(start + self.chunk_rows - 1, last_row)
+            sheet_chunk = [
+                fingerprint(ids[n - 2][0] if n - 2 < len(ids) and ids[n - 2] else None,
+                            statuses[n - 2] if n - 2 < len(statuses) else [])
+                for n in range(start, end + 1)
+            ]
+            cached_chunk = [
+                fingerprint(cached[n][0], cached[n][8:10]) if n in cached else None
+                for n in range(start, end + 1)
+            ]
+            if sheet_chunk != cached_chunk:
+                changed.append((start, end))
+
+        seen = set()
+        for start, end in changed:
+            rows = await self._get(f"Requests!A{start}:L{end}")
+            if index.generation != generation:
+                return
+            pending = self._pending_statuses()
+            for offset, row in enumerate(rows):
+                if row:
+                    seen.add(str(row[0]).strip())
+                    self._apply_row(start + offset, row, pending, version)
+        # Rows deleted from the sheet
+        keep = seen | self._pending_statuses()
+        for start, end in changed:
+            for row_number in range(start, end + 1):
+                previous = cached.get(row_number)
+                if previous and str(previous[0]).strip() not in keep:
+                    entry = index.get(previous[0])
+                    if entry and entry[0] == row_number:
+                        index.remove(previous[0])
+        if changed:
+            logging.info(f"Re-read {len(changed)} changed blocks of the Requests sheet")
+        if new_rows:
+            logging.info(f"Synced {len(new_rows)} new requests")
+
+    def _apply_row(self, row_number, row, pending, version):
+        # pending: requests with a status write queued or in flight right now
+        index = self.db.requests
+        request_id = str(row[0]).strip()
+        if index.get(request_id) and (request_id in pending or index.changed_since(request_id, version)):
+            # Our own status is newer than the row that was read
+            index.set_row_number(request_id, row_number)
+            return
+        index.add(row_number, row)
+
+    async def sync(self):
+        if not await self._spreadsheet_changed():
+            return
+        await self.sync_users()
+        await self.sync_requests()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logging.error(f"Incremental sync failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,22 @@
+import os
+import sys
+import pytest
+
+# The bot's modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeSheetsService, install_fake_sheets
+
+
+@pytest.fixture
+def sheets(monkeypatch, tmp_path):
+    # Fake Sheets API for every database.Database() created in the test
+    service = FakeSheetsService()
+    install_fake_sheets(service)
+    import database
+    monkeypatch.setattr(database, 'build', lambda *args, **kwargs: service)
+    monkeypatch.setattr(database, 'WRITE_SPOOL_FILE', str(tmp_path / 'pending_writes.jsonl'))
+    # Writes are flushed by the tests
+    monkeypatch.setattr(database, 'WRITE_BATCH_WINDOW', 60)
+    monkeypatch.setattr(database, 'SYNC_INTERVAL', 0)
+    return service
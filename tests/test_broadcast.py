@@ -0,0 +1,15 @@
+import json
+from broadcast import Broadcaster
+
+
+def test_unblocked_user_gets_broadcasts_again(tmp_path):
+    state_path = str(tmp_path / 'broadcasts.json')
+    broadcaster = Broadcaster(None, None, state_path, 20, 1)
+    broadcaster.blocked.update({"1000", "1001"})
+    assert broadcaster.unblock(1000)
+    assert not broadcaster.unblock(1000)
+    with open(state_path, encoding='utf-8') as f:
+        assert json.load(f)['blocked'] == ["1001"]
+
+    # Remembered across restarts
+    assert Broadcaster(None, None, state_path, 20, 1).blocked == {"1001"}
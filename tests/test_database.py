@@ -0,0 +1,120 @@
+import asyncio
+import json
+import database
+from storage import UNAVAILABLE
+
+
+def request_data(number):
+    return {
+        'request_id': f"20260101120000_{number}", 'user_id': number, 'name': f"User {number}",
+        'department': "Buxgalteriya", 'floor': "2", 'topic': "Internet", 'description': "Internet ishlamayapti"
+    }
+
+
+def sheet_statuses(sheets):
+    return [(row[0], row[8]) for row in sheets.sheets['Requests'][1:]]
+
+
+def queued(db):
+    return [(op['kind'], op.get('request_id') or op['row'][0], op.get('status')) for op in db.writes.pending()]
+
+
+def test_append_that_times_out_is_not_sent_again(sheets, monkeypatch):
+    monkeypatch.setattr(database, 'SHEETS_TIMEOUT', 0.2)
+
+    async def run():
+        db = database.Database()
+        await db.warm_up()
+        # Sheets applies the append but replies after the timeout
+        sheets.call_latency['values.append'] = 0.5
+        assert await db.save_request(request_data(1))
+        # Still running when the flush gives up waiting for it
+        assert not await db.writes.flush()
+        assert queued(db) == [('request', "20260101120000_1", None)]
+        sheets.call_latency.clear()
+        await asyncio.sleep(0.3)
+        assert await db.writes.flush()
+        assert sheet_statuses(sheets) == [("20260101120000_1", "Pending")]
+        assert await db.update_request_status("20260101120000_1", "Accepted", "staff")
+        assert await db.save_request(request_data(2))
+        assert await db.writes.flush()
+        assert sheet_statuses(sheets) == [("20260101120000_1", "Accepted"), ("20260101120000_2", "Pending")]
+        assert db.requests.get("20260101120000_1")[0] == 2
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_failed_writes_are_retried_in_order(sheets, tmp_path):
+    async def run():
+        db = database.Database()
+        await db.warm_up()
+        await db.save_request(request_data(1))
+        await db.writes.flush()
+
+        await db.update_request_status("20260101120000_1", "Accepted", "staff")
+        await db.save_request(request_data(2))
+        await db.update_request_status("20260101120000_2", "Accepted", "staff")
+        # The append is rejected, the status of the saved request still goes through
+        sheets.rejections['values.append'] = 1
+        sheets.latency = 0.05
+        flush = asyncio.create_task(db.writes.flush())
+        await asyncio.sleep(0.01)
+        await db.update_request_status("20260101120000_1", "Solved", "staff")
+        assert not await flush
+
+        assert sheet_statuses(sheets) == [("20260101120000_1", "Accepted")]
+        expected = [('request', "20260101120000_2", None), ('status', "20260101120000_2", "Accepted"),
+                    ('status', "20260101120000_1", "Solved")]
+        assert queued(db) == expected
+        with open(tmp_path / 'pending_writes.jsonl', encoding='utf-8') as f:
+            spooled = [json.loads(line) for line in f]
+        assert [(op['kind'], op.get('request_id') or op['row'][0], op.get('status')) for op in spooled] == expected
+
+        assert await db.writes.flush()
+        assert sheet_statuses(sheets) == [("20260101120000_1", "Solved"), ("20260101120000_2", "Accepted")]
+        assert not db.writes.pending()
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_registered_user_is_not_saved_twice_while_users_are_unavailable(sheets):
+    sheets.seed_users(3)
+
+    async def run():
+        db = database.Database()
+        # Sheets is down at start, the directory cannot be loaded
+        sheets.rejections['values.batchGet'] = 1
+        sheets.rejections['values.get'] = 1
+        await db.warm_up()
+        assert await db.get_user_data(1001) is UNAVAILABLE
+
+        # Registered again anyway, the queued row is dropped once the sheet can be read
+        assert await db.save_user({'name': "User 1", 'phone': "+998900000001", 'department': "Department 1",
+                                   'floor': "2", 'telegram_id': 1001, 'username': "user1"})
+        assert await db.writes.flush()
+        assert [row[4] for row in sheets.sheets['Users'][1:]] == ["1000", "1001", "1002"]
+        assert (await db.get_user_data(1001))['name'] == "User 1"
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_archived_request_is_found_with_archiving_off(sheets, monkeypatch):
+    monkeypatch.setattr(database, 'ARCHIVE_AFTER_DAYS', 0)
+    archived = ["20250301090000_1000", "1000", "User 0", "Department", "1", "Internet", "Old request",
+                "2025-03-01 09:00:00", "Solved", "staff", "2025-03-01 09:05:00", "2025-03-01 10:00:00"]
+    sheets.sheet_ids['Requests_2025_03'] = 2
+    sheets.sheets['Requests_2025_03'] = [sheets.sheets['Requests'][0], archived]
+
+    async def run():
+        db = database.Database()
+        await db.warm_up()
+        request = await db.get_request_data("20250301090000_1000")
+        assert request['status'] == "Solved" and request['user_id'] == "1000"
+        # Found in the month's sheet, Requests is not read again
+        assert sheets.calls['values.get'] == 1
+        await db.close()
+
+    asyncio.run(run())
@@ -0,0 +1,44 @@
+import asyncio
+import time
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+pytest.importorskip('redis')
+
+from fakes import FakeRedis
+from fsm_storage import create_fsm_storage
+
+KEY = StorageKey(bot_id=1, chat_id=1000, user_id=1000)
+
+
+def test_redis_storage_keeps_state_and_data():
+    async def run():
+        redis = FakeRedis()
+        storage = create_fsm_storage(redis=redis)
+        await storage.set_state(KEY, "RequestStates:waiting_for_description")
+        await storage.set_data(KEY, {'topic': "Internet", 'description': "Internet ishlamayapti"})
+        assert await storage.get_state(KEY) == "RequestStates:waiting_for_description"
+        assert await storage.get_data(KEY) == {'topic': "Internet", 'description': "Internet ishlamayapti"}
+        # Compact JSON without escaped non-ASCII characters
+        assert b'"topic":"Internet"' in next(value for value, _ in redis.values.values() if value.startswith(b'{'))
+
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        assert await storage.get_state(KEY) is None
+        assert await storage.get_data(KEY) == {}
+        assert not redis.values
+        await storage.close()
+        assert redis.closed
+
+    asyncio.run(run())
+
+
+def test_redis_storage_expires_abandoned_conversations(monkeypatch):
+    async def run():
+        storage = create_fsm_storage(redis=FakeRedis())
+        await storage.set_state(KEY, "RegistrationStates:waiting_for_name")
+        now = time.monotonic()
+        monkeypatch.setattr(time, 'monotonic', lambda: now + storage.state_ttl + 1)
+        assert await storage.get_state(KEY) is None
+
+    asyncio.run(run())
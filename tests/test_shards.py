@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHARD_SETTINGS = ('SHARDS', 'SHARD_INDEX', 'WRITE_SPOOL_FILE', 'BROADCAST_STATE_FILE', 'OUTBOX_SPOOL_FILE',
+                  'METRICS_PORT')
+
+
+def _report_config(index, shards, queue):
+    # Runs in a spawned process, like Supervisor's workers
+    import shards as shard_module
+    config = shard_module.configure_shard(index, shards)
+    queue.put({name: getattr(config, name) for name in SHARD_SETTINGS})
+
+
+def test_importing_shards_does_not_load_config():
+    code = "import sys, shards; assert 'config' not in sys.modules and 'keyboards' not in sys.modules"
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+
+
+def test_each_worker_gets_its_own_config(monkeypatch):
+    # Supervisor(n) used without SHARDS in the environment
+    for name in ('SHARDS', 'SHARD_INDEX', 'WRITE_SPOOL_FILE', 'BROADCAST_STATE_FILE', 'OUTBOX_SPOOL_FILE'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv('METRICS_PORT', '9100')
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    processes = [context.Process(target=_report_config, args=(index, 3, queue)) for index in range(3)]
+    for process in processes:
+        process.start()
+    reports = sorted((queue.get(timeout=30) for _ in processes), key=lambda report: report['SHARD_INDEX'])
+    for process in processes:
+        process.join(timeout=30)
+        assert process.exitcode == 0
+
+    assert [report['SHARD_INDEX'] for report in reports] == [0, 1, 2]
+    assert all(report['SHARDS'] == 3 for report in reports)
+    assert [report['METRICS_PORT'] for report in reports] == [9100, 9101, 9102]
+    for name in ('WRITE_SPOOL_FILE', 'BROADCAST_STATE_FILE', 'OUTBOX_SPOOL_FILE'):
+        assert len({report[name] for report in reports}) == 3
+        assert all(report[name].endswith(f".{index}") for index, report in enumerate(reports))
+
+
+class FakeProcess:
+    def __init__(self, index, alive=True):
+        self.name = f"shard-{index}"
+        self.alive = alive
+        self.exitcode = None if alive else -9
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+    def is_alive(self):
+        return self.alive
+
+
+def test_dead_worker_is_restarted():
+    import shards
+    supervisor = shards.Supervisor(2)
+    supervisor._new_process = FakeProcess
+    supervisor._processes = [FakeProcess(0), FakeProcess(1, alive=False)]
+
+    supervisor.check_workers()
+    replacement = supervisor._processes[1]
+    assert replacement.started and replacement.is_alive()
+    assert supervisor._processes[0].name == "shard-0" and not supervisor._processes[0].started
+
+    # A worker that keeps dying stops the supervisor
+    for _ in range(shards.RESTART_LIMIT - 1):
+        supervisor._processes[1].alive = False
+        supervisor.check_workers()
+    supervisor._processes[1].alive = False
+    with pytest.raises(RuntimeError):
+        supervisor.check_workers()
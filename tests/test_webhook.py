@@ -0,0 +1,46 @@
+import asyncio
+import time
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from fakes import FakeTelegramSession, FakeUpdatePoster
+from webhook import create_app
+
+
+def message_update(update_id):
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()), 'text': "/start",
+        'chat': {'id': 1000, 'type': 'private'}, 'from': {'id': 1000, 'is_bot': False, 'first_name': "User"}
+    }}
+
+
+def test_updates_in_progress_are_finished_before_shutdown():
+    async def run():
+        dispatcher = Dispatcher()
+        handled = []
+        drained = []
+
+        @dispatcher.message()
+        async def slow_handler(message):
+            await asyncio.sleep(0.2)
+            handled.append(message.message_id)
+
+        async def on_drained():
+            drained.append(len(handled))
+
+        bot = Bot(token="123456:TEST", session=FakeTelegramSession())
+        runner = web.AppRunner(create_app(dispatcher, bot, '/webhook', secret_token="secret",
+                                          on_drained=[on_drained]))
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 0).start()
+        host, port = runner.addresses[0][:2]
+        poster = FakeUpdatePoster(dispatcher, f"http://{host}:{port}/webhook", "secret")
+
+        await asyncio.gather(*[poster.post(message_update(i), wait=False) for i in range(1, 6)])
+        # Telegram got its replies before the updates were handled
+        assert not handled
+        await runner.cleanup()
+        await poster.close()
+        assert sorted(handled) == [1, 2, 3, 4, 5]
+        assert drained == [5]
+
+    asyncio.run(run())
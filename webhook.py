@@ -0,0 +1,48 @@
+import asyncio
+import logging
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+DRAIN_TIMEOUT = 30
+
+
+# Updates are handled in background tasks, Telegram gets its reply right away.
+# On shutdown the handler waits for the tasks still running before the bot
+# session is closed, then runs the on_drained callbacks (outbox, pending writes).
+class DrainingRequestHandler(SimpleRequestHandler):
+    def __init__(self, *args, on_drained=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_drained = list(on_drained)
+
+    async def close(self):
+        tasks = set(self._background_feed_update_tasks)
+        if tasks:
+            logging.info(f"Waiting for {len(tasks)} updates in progress")
+            _, pending = await asyncio.wait(tasks, timeout=DRAIN_TIMEOUT)
+            if pending:
+                logging.warning(f"{len(pending)} updates did not finish before shutdown")
+        for callback in self.on_drained:
+            try:
+                await callback()
+            except Exception as e:
+                logging.error(f"Error during shutdown: {e}")
+        await super().close()
+
+
+def create_app(dispatcher, bot, path, secret_token=None, health=None, on_drained=()):
+    app = web.Application()
+    handler = DrainingRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        secret_token=secret_token,
+        handle_in_background=True,
+        on_drained=on_drained
+    )
+    handler.register(app, path=path)
+
+    async def health_check(request):
+        return web.json_response({'status': 'ok', **(health() if health else {})})
+
+    app.router.add_get('/health', health_check)
+    setup_application(app, dispatcher, bot=bot)
+    return app
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import logging
+import os
+
+
+# Write-behind queue: operations are spooled to disk as soon as they are
+# enqueued and flushed together once the batch window passes or the batch is full.
+# The flush callback receives the pending operations in order and returns the
+# ones that could not be written yet. Until restore() has read the spool left by
+# the previous run, new operations are only appended to it, never rewritten.
+# After a flush that left operations behind, the next one waits at least one
+# window, or retry_delay() seconds if that is longer (e.g. a circuit breaker).
+class WriteQueue:
+    def __init__(self, flush_callback, spool_path, window, max_ops, retry_delay=None):
+        self._flush_callback = flush_callback
+        self._retry_delay = retry_delay
+        self._spool_path = spool_path
+        self._window = window
+        self._max_ops = max_ops
+        self._pending = []
+        self._flushing = []
+        self._has_ops = asyncio.Event()
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._restored = False
+
+    def pending(self):
+        # Includes the operations of a flush that is still running
+        return self._flushing + self._pending
+
+    def paused(self):
+        # Holding this keeps writes queued, e.g. while rows are moved in the sheet
+        return self._flush_lock
+
+    def restore(self, keep):
+        # Replays the spool left by a previous run; keep(op) applies an operation
+        # to the caches and returns False if it already reached the sheet
+        if not os.path.exists(self._spool_path):
+            self._restored = True
+            return
+        ops = []
+        with open(self._spool_path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    op = json.loads(line)
+                    if keep(op):
+                        ops.append(op)
+        self._pending = ops + self._pending
+        self._restored = True
+        self._rewrite_spool()
+        if ops:
+            logging.info(f"Restored {len(ops)} unflushed writes from {self._spool_path}")
+            self._has_ops.set()
+            self._ensure_running()
+
+    def _spool(self, op):
+        with open(self._spool_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(op, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite_spool(self):
+        if not self._restored:
+            # The spool still holds writes of the previous run, keep them until
+            # restore(); writes flushed meanwhile are skipped there by keep()
+            return
+        tmp_path = self._spool_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for op in self._pending:
+                f.write(json.dumps(op, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._spool_path)
+
+    def enqueue(self, op):
+        self._spool(op)
+        self._pending.append(op)
+        self._has_ops.set()
+        if len(self._pending) >= self._max_ops:
+            self._full.set()
+        self._ensure_running()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self._has_ops.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self._window)
+            except asyncio.TimeoutError:
+                pass
+            if not await self.flush():
+                delay = max(self._window, self._retry_delay() if self._retry_delay else 0)
+                await asyncio.sleep(delay)
+
+    async def flush(self):
+        async with self._flush_lock:
+            ops, self._pending = self._pending, []
+            self._has_ops.clear()
+            self._full.clear()
+            if not ops:
+                return True
+            self._flushing = ops
+            try:
+                retry = await self._flush_callback(ops)
+            except asyncio.CancelledError:
+                # Still in the spool, keep them for the final flush
+                self._pending = ops + self._pending
+                raise
+            except Exception as e:
+                logging.error(f"Failed to flush {len(ops)} writes, will retry: {e}")
+                retry = ops
+            finally:
+                self._flushing = []
+            self._pending = retry + self._pending
+            if len(retry) < len(ops):
+                # Otherwise nothing was written and the spool already matches
+                self._rewrite_spool()
+            if self._pending:
+                self._has_ops.set()
+                if not retry and len(self._pending) >= self._max_ops:
+                    self._full.set()
+            return not retry
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()